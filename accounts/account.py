@@ -1,20 +1,85 @@
-import json
-
-import pandas as pd
-
+from accounts.capture import endpoint_metric, endpoint_name, get_capture, loads
 from accounts.portfolio import *
+from accounts.tracker import PortfolioTracker
+from metrics import metrics
 from settings import *
 
 
 # Handle errors
 def error(response, msg):
-    logger.debug("Response Body: %s", response.text)
-    if response is not None and response.headers['Content-Type'] == 'application/json' \
-            and "Error" in response.json() and "message" in response.json()["Error"] \
-            and response.json()["Error"]["message"] is not None:
-        print("Error: " + response.json()["Error"]["message"])
-    else:
-        print(msg)
+    if response is not None:
+        logger.debug("Response Body: %s", response.content)
+        if response.headers.get('Content-Type') == 'application/json' and response.content:
+            data = loads(response.content)
+            if "Error" in data and data["Error"].get("message") is not None:
+                print("Error: " + data["Error"]["message"])
+                return
+    print(msg)
+
+
+def get_accounts(data):
+    """Open accounts of an AccountListResponse, None if the response has no account list"""
+    if data is not None and "AccountListResponse" in data and "Accounts" in data["AccountListResponse"]:
+        if "Account" in data["AccountListResponse"]["Accounts"]:
+            accounts = data["AccountListResponse"]["Accounts"]["Account"]
+            return [d for d in accounts if d.get('accountStatus') != 'CLOSED']
+
+
+def find_account(data, account_id):
+    """The account with account_id from an AccountListResponse"""
+    for account in get_accounts(data) or []:
+        if account["accountId"] == account_id:
+            return account
+
+
+def get_positions(data):
+    """Raw positions of all AccountPortfolio entries of a PortfolioResponse, None if there are none"""
+    if data is not None and "PortfolioResponse" in data and "AccountPortfolio" in data["PortfolioResponse"]:
+        portfolio = []
+        for p in data["PortfolioResponse"]["AccountPortfolio"]:
+            if p is not None and "Position" in p:
+                portfolio.extend(p["Position"])
+        return portfolio
+
+
+def get_balance_data(data):
+    """Summary of a BalanceResponse, None if the response has no balance"""
+    if data is not None and "BalanceResponse" in data:
+        balance_data = {}
+        data = data["BalanceResponse"]
+        if data is not None:
+            balance_data["account_number"] = data.get("accountId", "")
+            balance_data["account_name"] = data.get("accountDescription", "")
+
+            if "Computed" in data:
+                if "RealTimeValues" in data["Computed"]:
+                    balance_data["value"] = data["Computed"]["RealTimeValues"].get("totalAccountValue", 0)
+                balance_data["margin_bp"] = data["Computed"].get("marginBuyingPower", 0)
+                balance_data["cash_bp"] = data["Computed"].get("cashBuyingPower", 0)
+
+            return balance_data
+
+
+def get_quote_data(data):
+    """QuoteData entries of a QuoteResponse, None if the response has none"""
+    if data is not None and "QuoteResponse" in data and "QuoteData" in data["QuoteResponse"]:
+        return data["QuoteResponse"]["QuoteData"]
+
+
+def quote_path(symbols):
+    """Quote endpoint path for a batch of symbols"""
+    return "/v1/market/quote/" + ",".join(symbols) + ".json"
+
+
+def timed_get(session, url, **kwargs):
+    """session.get, timed per endpoint and counting the bytes received"""
+    metric = endpoint_metric(endpoint_name(url, kwargs.get("params")))
+    with metrics.timer("http " + metric):
+        response = session.get(url, **kwargs)
+    metrics.count("bytes received", len(response.content))
+    metrics.count("bytes " + metric, len(response.content))
+    metrics.count("status {}".format(response.status_code))
+    return response
 
 
 class Account:
@@ -27,6 +92,7 @@ class Account:
         self.account_id = account_id
         self.session = session
         self.base_url = base_url
+        self.tracker = PortfolioTracker()
         self.account = self.get_account()
 
     def get_account(self):
@@ -40,22 +106,16 @@ class Account:
         url = self.base_url + "/v1/accounts/list.json"
 
         # Make API call for GET request
-        response = self.session.get(url, header_auth=True)
+        response = timed_get(self.session, url, header_auth=True)
         logger.debug("Request Header: %s", response.request.headers)
 
         # Handle and parse response
         if response is not None and response.status_code == 200:
-            parsed = json.loads(response.text)
-            logger.debug("Response Body: %s", json.dumps(parsed, indent=4, sort_keys=True))
-
-            data = response.json()
-            if data is not None and "AccountListResponse" in data and "Accounts" in data["AccountListResponse"]:
-                if "Account" in data["AccountListResponse"]["Accounts"]:
-                    accounts = data["AccountListResponse"]["Accounts"]["Account"]
-                    accounts[:] = [d for d in accounts if d.get('accountStatus') != 'CLOSED']
-                    for account in accounts:
-                        if account["accountId"] == self.account_id:
-                            return account
+            data = get_capture()(endpoint_name(url), response.content)
+
+            account = find_account(data, self.account_id)
+            if account is not None:
+                return account
 
             error(response, "Error: AccountList API service error")
 
@@ -69,68 +129,16 @@ class Account:
         url = self.base_url + "/v1/accounts/" + self.account["accountIdKey"] + "/portfolio.json"
 
         # Make API call for GET request
-        response = self.session.get(url, params={'view': 'COMPLETE'}, header_auth=True)
+        response = timed_get(self.session, url, params={'view': 'COMPLETE'}, header_auth=True)
         logger.debug("Request Header: %s", response.request.headers)
 
         # Handle and parse response
         if response is not None:
             if response.status_code == 200:
-                parsed = json.loads(response.text)
-                logger.debug("Response Body: %s", json.dumps(parsed, indent=4, sort_keys=True))
-                data = response.json()
-                portfolio = []
-
-                if data is not None and "PortfolioResponse" in data and "AccountPortfolio" in data["PortfolioResponse"]:
-                    for p in data["PortfolioResponse"]["AccountPortfolio"]:
-                        if p is not None and "Position" in p:
-                            portfolio.extend(p["Position"])
-
-                    df = pd.DataFrame(portfolio)
-                    portfolio = []
-
-                    options = df["Product"].apply(pd.Series)
-                    options = options.loc[options['securityType'] == 'OPTN']
-                    cols = ['positionId', 'quantity', 'pricePaid', 'daysGain', 'daysGainPct', 'totalGain',
-                            'totalGainPct']
-                    options[cols] = df[cols]
-
-                    complete = df["Complete"].apply(pd.Series)
-                    options['bid'] = complete['bid']
-                    options['ask'] = complete['ask']
-                    options = options.rename(columns={"expiryYear": "year", "expiryMonth": "month", "expiryDay": "day"})
-                    options["Date"] = pd.to_datetime(options[["year", "month", "day"]])
-
-                    group = options.groupby(['Date', 'symbol'])
-
-                    for name, g in group:
-                        spreads = get_spreads(g)
-                        legs = [Leg(g.iloc[i, :]) for i in range(len(g))]
-
-                        position = Position(name, spreads, legs)
-                        position.strategy = "Complex Strategy"
-
-                        if len(legs) == 1:
-                            direction = "Long" if legs[0].quantity > 0 else "Short"
-                            position.strategy = direction + " " + legs[0].option_type
-
-                        elif len(legs) == 2:
-                            if legs[0].quantity == legs[1].quantity:
-                                direction = "Long" if legs[0].quantity > 0 else "Short"
-                                strategy = "Straddle" if legs[0].strike == legs[1].strike else "Strangle"
-                                position.strategy = direction + " " + strategy
-
-                        elif len(legs) == 4:
-                            if len(spreads) == 2:
-                                s0, s1 = spreads[0], spreads[1]
-                                if s0.option_type != s1.option_type and s0.direction == s1.direction:
-                                    direction = "Long" if s0.direction == "debit" else "Short"
-                                    if s0.strikes[0] in s1.strikes or s0.strikes[0] in spreads[1].strikes:
-                                        strategy = "Butterfly"
-                                    else:
-                                        strategy = "Iron Condor"
-                                    position.strategy = direction + " " + strategy
-                        portfolio.append(position)
-                    return portfolio
+                data = get_capture()(endpoint_name(url), response.content)
+                portfolio = get_positions(data)
+                if portfolio is not None:
+                    return self.tracker.update(portfolio)
 
             if response.status_code == 204:
                 print("No Positions found")
@@ -138,54 +146,6 @@ class Account:
         error(response, "Error: Portfolio API service error")
         return None
 
-    # def get_portfolio():
-    #     df = pd.read_pickle("testing.pkl")
-    #     portfolio = []
-    #
-    #     options = df["Product"].apply(pd.Series)
-    #     options = options.loc[options['securityType'] == 'OPTN']
-    #     cols = ['positionId', 'quantity', 'pricePaid', 'daysGain', 'daysGainPct', 'totalGain', 'totalGainPct']
-    #     options[cols] = df[cols]
-    #
-    #
-    #     complete = df["Complete"].apply(pd.Series)
-    #     options['bid'] = complete['bid']
-    #     options['ask'] = complete['ask']
-    #     options = options.rename(columns={"expiryYear": "year", "expiryMonth": "month", "expiryDay": "day"})
-    #     options["Date"] = pd.to_datetime(options[["year", "month", "day"]])
-    #
-    #     group = options.groupby(['Date', 'symbol'])
-    #
-    #     for name, g in group:
-    #         spreads = get_spreads(g)
-    #         legs = [Leg(g.iloc[i, :]) for i in range(len(g))]
-    #
-    #         position = Position(name, spreads, legs)
-    #         position.strategy = "Complex Strategy"
-    #
-    #         if len(legs) == 1:
-    #             direction = "Long" if legs[0].quantity > 0 else "Short"
-    #             position.strategy = direction + " " + legs[0].option_type
-    #
-    #         elif len(legs) == 2:
-    #             if legs[0].quantity == legs[1].quantity:
-    #                 direction = "Long" if legs[0].quantity > 0 else "Short"
-    #                 strategy = "Straddle" if legs[0].strike == legs[1].strike else "Strangle"
-    #                 position.strategy = direction + " " + strategy
-    #
-    #         elif len(legs) == 4:
-    #             if len(spreads) == 2:
-    #                 s0, s1 = spreads[0], spreads[1]
-    #                 if s0.option_type != s1.option_type and s0.direction == s1.direction:
-    #                     direction = "Long" if s0.direction == "debit" < 0 else "Short"
-    #                     if s0.strikes[0] in s1.strikes or s0.strikes[0] in spreads[1].strikes:
-    #                         strategy = "Butterfly"
-    #                     else:
-    #                         strategy = "Iron Condor"
-    #                     position.strategy = direction + " " + strategy
-    #         portfolio.append(position)
-    #     return portfolio
-
     def get_balance(self):
         """
         Calls account balance API to retrieve the current balance and related details for a specified account
@@ -201,28 +161,38 @@ class Account:
         headers = {"consumerkey": config["DEFAULT"]["CONSUMER_KEY"]}
 
         # Make API call for GET request
-        response = self.session.get(url, header_auth=True, params=params, headers=headers)
+        response = timed_get(self.session, url, header_auth=True, params=params, headers=headers)
         logger.debug("Request url: %s", url)
         logger.debug("Request Header: %s", response.request.headers)
 
         # Handle and parse response
         if response is not None and response.status_code == 200:
-            parsed = json.loads(response.text)
-            logger.debug("Response Body: %s", json.dumps(parsed, indent=4, sort_keys=True))
-            data = response.json()
-            if data is not None and "BalanceResponse" in data:
-                balance_data = {}
-                data = data["BalanceResponse"]
-                if data is not None:
-                    balance_data["account_number"] = data.get("accountId", "")
-                    balance_data["account_name"] = data.get("accountDescription", "")
-
-                    if "Computed" in data:
-                        if "RealTimeValues" in data["Computed"]:
-                            balance_data["value"] = data["Computed"]["RealTimeValues"].get("totalAccountValue", 0)
-                        balance_data["margin_bp"] = data["Computed"].get("marginBuyingPower", 0)
-                        balance_data["cash_bp"] = data["Computed"].get("cashBuyingPower", 0)
-
-                    return balance_data
+            data = get_capture()(endpoint_name(url), response.content)
+            balance_data = get_balance_data(data)
+            if balance_data is not None:
+                return balance_data
 
         error(response, "Error: Balance API service error")
+
+    def get_quotes(self, symbols):
+        """
+        Calls quote API to retrieve quote details for up to 25 symbols
+
+        :param symbols: list of symbols, options as "SYMBOL:YEAR:MONTH:DAY:CALLPUT:STRIKE"
+        """
+
+        # URL for the API endpoint
+        url = self.base_url + quote_path(symbols)
+
+        # Make API call for GET request
+        response = timed_get(self.session, url, params={"detailFlag": "ALL"}, header_auth=True)
+        logger.debug("Request Header: %s", response.request.headers)
+
+        # Handle and parse response
+        if response is not None and response.status_code == 200:
+            data = get_capture()(endpoint_name(url), response.content)
+            quotes = get_quote_data(data)
+            if quotes is not None:
+                return quotes
+
+        error(response, "Error: Quote API service error")
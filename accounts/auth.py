@@ -0,0 +1,168 @@
+import datetime
+import json
+import os
+import threading
+import time
+import webbrowser
+from zoneinfo import ZoneInfo
+
+from rauth import OAuth1Service
+
+from settings import *
+
+OAUTH_BASE_URL = "https://api.etrade.com"
+AUTHORIZE_URL = "https://us.etrade.com/e/t/etws/authorize?key={}&token={}"
+EASTERN = ZoneInfo("America/New_York")  # access tokens expire at midnight US Eastern time
+RENEW_EVERY = 90 * 60  # seconds, tokens go inactive after two idle hours
+
+
+def token_expiry(issued):
+    """Time the access token issued at issued stops working: the next midnight Eastern"""
+    day = datetime.datetime.fromtimestamp(issued, EASTERN).date() + datetime.timedelta(days=1)
+    return datetime.datetime.combine(day, datetime.time(), EASTERN).timestamp()
+
+
+def read_tokens(path):
+    """Stored tokens, None if there are none"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_tokens(path, tokens):
+    """Store tokens readable by the owner only, replacing the file atomically"""
+    temp = path + ".tmp"
+    fd = os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        json.dump(tokens, f)
+    os.chmod(temp, 0o600)
+    os.replace(temp, path)
+
+
+class TokenManager:
+    def __init__(self, consumer_key, consumer_secret, path, oauth_url=OAUTH_BASE_URL, authorize_url=AUTHORIZE_URL,
+                 renew_every=RENEW_EVERY, prompt=input, browser=webbrowser.open):
+        """
+        Keeps an OAuth 1 access token across restarts
+
+        The access token is stored in path and reused until it expires at midnight Eastern. When
+        it may have gone inactive it is renewed first, and renew_access_token is called every
+        renew_every seconds while the app runs. The browser flow only runs when there is no
+        usable token.
+
+        :param path: token file, only readable by the owner
+        :param oauth_url: base url of the /oauth endpoints
+        :param authorize_url: authorization page, formatted with the consumer key and request token
+        :param prompt: asks for the verification code, called with the message
+        :param browser: opens the authorization page, called with the url
+        """
+        self.consumer_key = consumer_key
+        self.path = path
+        self.renew_every = renew_every
+        self.prompt = prompt
+        self.browser = browser
+        self.service = OAuth1Service(
+            name="etrade",
+            consumer_key=consumer_key,
+            consumer_secret=consumer_secret,
+            request_token_url=oauth_url + "/oauth/request_token",
+            access_token_url=oauth_url + "/oauth/access_token",
+            authorize_url=authorize_url,
+            base_url=oauth_url)
+        self.renew_url = oauth_url + "/oauth/renew_access_token"
+        self.tokens = None
+        self.session = None
+        self.rejected = False  # the server refused to renew the token
+        self.stopping = threading.Event()
+        self.thread = None
+
+    @classmethod
+    def from_config(cls, prompt=input):
+        """Manager set up from config.ini, prompt as in __init__"""
+        return cls(config["DEFAULT"]["CONSUMER_KEY"], config["DEFAULT"]["CONSUMER_SECRET"],
+                   config.get("DEFAULT", "TOKEN_FILE", fallback=".tokens.json"),
+                   config.get("DEFAULT", "OAUTH_BASE_URL", fallback=OAUTH_BASE_URL),
+                   config.get("DEFAULT", "AUTHORIZE_URL", fallback=AUTHORIZE_URL),
+                   config.getfloat("DEFAULT", "RENEW_MINUTES", fallback=RENEW_EVERY / 60) * 60, prompt)
+
+    def get_session(self):
+        """
+        Authenticated rauth session, from the stored token when it is still good
+
+        :return: OAuth1Session
+        """
+        now = time.time()
+        tokens = read_tokens(self.path)
+        if tokens is not None and tokens.get("consumer_key") == self.consumer_key \
+                and now < token_expiry(tokens["issued"]):
+            self.tokens = tokens
+            self.session = self.service.get_session((tokens["access_token"], tokens["access_token_secret"]))
+            if now - tokens["used"] < self.renew_every or self.renew():
+                return self.session
+            logger.debug("Stored access token could not be renewed")
+
+        return self.authorize()
+
+    def authorize(self):
+        """Interactive request token -> browser -> verifier exchange"""
+        request_token, request_token_secret = self.service.get_request_token(
+            params={"oauth_callback": "oob", "format": "json"})
+        self.browser(self.service.authorize_url.format(self.consumer_key, request_token))
+
+        text_code = self.prompt("Please accept agreement and enter text code from browser: ")
+        self.session = self.service.get_auth_session(request_token, request_token_secret,
+                                                     params={"oauth_verifier": text_code})
+        now = time.time()
+        self.tokens = {"consumer_key": self.consumer_key, "access_token": self.session.access_token,
+                       "access_token_secret": self.session.access_token_secret, "issued": now, "used": now}
+        self.rejected = False
+        write_tokens(self.path, self.tokens)
+        return self.session
+
+    def expired(self):
+        """True when the access token stopped working and only authorize() can replace it"""
+        return self.tokens is None or self.rejected or time.time() >= token_expiry(self.tokens["issued"])
+
+    def renew(self):
+        """
+        Reactivate the access token, it is only good until midnight Eastern either way
+
+        :return: True if the token was renewed
+        """
+        try:
+            response = self.session.get(self.renew_url, params={}, header_auth=True)
+        except Exception as e:
+            logger.debug("Renewing the access token failed: %s", e)
+            return False
+        if response.status_code != 200:
+            logger.debug("Renewing the access token failed: %s %s", response.status_code, response.text)
+            self.rejected = response.status_code == 401
+            return False
+        self.touch()
+        return True
+
+    def touch(self):
+        """Remember that the token was used now"""
+        if self.tokens is not None:
+            self.tokens["used"] = time.time()
+            write_tokens(self.path, self.tokens)
+
+    def start(self):
+        """Renew the token every renew_every seconds on a background thread"""
+        self.thread = threading.Thread(target=self.run, name="renew", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stopping.wait(self.renew_every):
+            if not self.expired():
+                self.renew()
+            elif self.tokens is not None:
+                # Nothing renews an expired token, main() offers to authorize again
+                logger.debug("Access token expired at %s", time.ctime(token_expiry(self.tokens["issued"])))
+
+    def stop(self):
+        """Stop renewing and record the last use of the token"""
+        self.stopping.set()
+        self.touch()
@@ -0,0 +1,116 @@
+import datetime
+
+from accounts.portfolio import *
+
+# NumPy is imported by the functions that use it: the tracker only needs extract_rows, and
+# importing NumPy would add to the startup time before the first frame
+
+# Per-leg columns pulled out of the PortfolioResponse "Position" objects, in row order
+COLUMNS = tuple(name for name, _ in ROW_COLUMNS)
+GAIN_COLUMNS = ('daysGain', 'daysGainPct', 'totalGain', 'totalGainPct')
+
+
+def extract_rows(positions):
+    """
+    Flatten raw portfolio positions into tuples of COLUMNS, keeping options and stock
+
+    Stock legs have type STOCK, strike 0 and the STOCK_DATE date.
+
+    :param positions: list of "Position" dicts from the PortfolioResponse
+    """
+    rows = []
+    stock_date = STOCK_DATE.toordinal()
+    for p in positions:
+        product = p.get("Product", {})
+        security = product.get("securityType")
+        if security == "OPTN":
+            date = datetime.date(product["expiryYear"], product["expiryMonth"], product["expiryDay"]).toordinal()
+            call_put, strike = product["callPut"], product["strikePrice"]
+        elif security == "EQ":
+            date, call_put, strike = stock_date, STOCK, 0.0
+        else:
+            continue
+        complete = p.get("Complete", {})
+        rows.append((p["positionId"], product["symbol"], call_put, strike,
+                     date, p["quantity"], p["pricePaid"],
+                     p["daysGain"], p["daysGainPct"], p["totalGain"], p["totalGainPct"],
+                     complete.get("bid", 0.0), complete.get("ask", 0.0)))
+    return rows
+
+
+def columns_from_rows(rows):
+    """Transpose extract_rows() tuples into a dict of column name -> NumPy array"""
+    import numpy as np
+
+    if not rows:
+        return {c: np.empty(0) for c in COLUMNS}
+
+    columns = {}
+    for name, values in zip(COLUMNS, zip(*rows)):
+        if name in ('positionId', 'symbol', 'callPut'):
+            columns[name] = np.array(values, dtype=object)
+        elif name in ('date', 'quantity'):
+            columns[name] = np.array(values, dtype=np.int64)
+        else:
+            columns[name] = np.array(values, dtype=np.float64)
+    return columns
+
+
+def group_columns(columns):
+    """
+    Order rows by (Date, symbol), keeping the original order inside each group
+
+    :return: (order, starts) - row permutation and the start offset of each group within it
+    """
+    import numpy as np
+
+    _, codes = np.unique(columns['symbol'].astype(str), return_inverse=True)
+    order = np.lexsort((codes, columns['date']))
+    keys = columns['date'][order] * (codes.max() + 1) + codes[order]
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(keys)) + 1))
+    return order, starts
+
+
+def build_portfolio(positions, store=None):
+    """
+    Build the list of Position objects from raw portfolio positions
+
+    Legs are extracted into columns, gains are aggregated per group with grouped reductions
+    and the Leg, Spread and Position objects are only created at the end.
+
+    :param positions: list of "Position" dicts from the PortfolioResponse
+    :param store: LegStore to add the legs to, a new one if None
+    """
+    return build_rows(extract_rows(positions), store)
+
+
+def build_rows(rows, store=None):
+    """Build the list of Position objects from extract_rows() tuples, see build_portfolio"""
+    import numpy as np
+
+    if not rows:
+        return []
+    columns = columns_from_rows(rows)
+
+    order, starts = group_columns(columns)
+    ends = np.append(starts[1:], len(order))
+
+    # Per position gains: sum of the per leg rounded values, same as Position used to compute
+    gains = {}
+    for name in GAIN_COLUMNS:
+        rounded = np.round(columns[name][order], 2)
+        gains[name] = np.round(np.add.reduceat(rounded, starts), 2).tolist()
+
+    if store is None:
+        store = LegStore()
+    all_legs = store.extend([rows[i] for i in order.tolist()])
+
+    portfolio = []
+    for n, (start, end) in enumerate(zip(starts.tolist(), ends.tolist())):
+        legs = all_legs[start:end]
+        spreads = get_spreads(legs)
+
+        portfolio.append(Position((legs[0].date, legs[0].symbol), spreads, legs,
+                                  gains=tuple(gains[name][n] for name in GAIN_COLUMNS)))
+    name_positions(portfolio)
+    return portfolio
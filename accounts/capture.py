@@ -0,0 +1,123 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from metrics import metrics
+from settings import *
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(body):
+    """Parse a JSON body, with orjson when it is installed"""
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+def dumps_pretty(data):
+    """Indented JSON for the debug log"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS).decode()
+    return json.dumps(data, indent=4, sort_keys=True)
+
+
+def endpoint_name(path, params=None):
+    """
+    Short name of the API endpoint of a request: list, portfolio, balance or quote
+
+    Portfolio pages after the first are named portfolio-<page>.
+    """
+    if "/market/quote/" in path:
+        return "quote"
+    name = path.rsplit("/", 1)[-1].split(".")[0]
+    if params and params.get("pageNumber", 1) != 1:
+        name += "-%d" % params["pageNumber"]
+    return name
+
+
+def endpoint_metric(name):
+    """Endpoint name without the page suffix, so all pages share one latency histogram"""
+    return name.split("-", 1)[0]
+
+
+class ResponseCapture:
+    def __init__(self, directory=None, max_bytes=100 * 1024 * 1024):
+        """
+        Parses response bodies once and formats them for the log only when debug logging is on
+
+        When a directory is given, raw bodies are also written there as <time ms>-<endpoint>.json,
+        deleting the oldest files once they take more than max_bytes.
+
+        :param directory: where to keep raw bodies for replay, not kept if None
+        :param max_bytes: size cap of the directory
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.files = deque()  # (path, size), oldest first
+        self.size = 0
+        self.last = 0  # time ms of the last file, kept unique
+        self.lock = threading.Lock()
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            for name in sorted(os.listdir(directory)):
+                if name.endswith(".json"):
+                    path = os.path.join(directory, name)
+                    self.files.append((path, os.path.getsize(path)))
+                    self.size += self.files[-1][1]
+
+    @classmethod
+    def from_config(cls):
+        """Capture set up from the [CAPTURE] section of config.ini"""
+        return cls(config.get("CAPTURE", "DIR", fallback=None) or None,
+                   int(config.getfloat("CAPTURE", "MAX_MB", fallback=100) * 1024 * 1024))
+
+    def __call__(self, endpoint, body):
+        """
+        Parse a successful response body
+
+        :param endpoint: endpoint name, see endpoint_name
+        :param body: raw response body bytes
+        """
+        with metrics.timer("parse"):
+            data = loads(body) if body else None
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Response Body: %s", dumps_pretty(data))
+        if self.directory is not None and body:
+            self.write(endpoint, body)
+        return data
+
+    def write(self, endpoint, body):
+        with self.lock:
+            self.last = max(int(time.time() * 1000), self.last + 1)
+            path = os.path.join(self.directory, "%013d-%s.json" % (self.last, endpoint))
+            with open(path, "wb") as f:
+                f.write(body)
+            self.files.append((path, len(body)))
+            self.size += len(body)
+
+            while self.size > self.max_bytes and len(self.files) > 1:
+                path, size = self.files.popleft()
+                self.size -= size
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+_capture = None
+
+
+def get_capture():
+    """The ResponseCapture shared by the API clients"""
+    global _capture
+    if _capture is None:
+        _capture = ResponseCapture.from_config()
+    return _capture
@@ -0,0 +1,205 @@
+import asyncio
+import time
+from hashlib import sha1
+from random import random
+from urllib.parse import quote
+
+from rauth.oauth import HmacSha1Signature
+
+from accounts.account import find_account, get_balance_data, get_positions, get_quote_data, quote_path
+from accounts.capture import endpoint_metric, endpoint_name, get_capture, loads
+from accounts.quotes import QUOTE_BATCH, QuoteEngine
+from accounts.tracker import PortfolioTracker
+from metrics import metrics
+from settings import *
+
+PAGE_SIZE = 50  # positions per portfolio page
+
+
+class ApiError(Exception):
+    """Non successful API response"""
+
+    def __init__(self, status, message):
+        super().__init__("{} ({})".format(message, status))
+        self.status = status
+
+
+class OAuth1Signer:
+    """Signs requests with OAuth 1 HMAC-SHA1, the same way rauth sessions do"""
+
+    def __init__(self, consumer_key, consumer_secret, access_token, access_token_secret):
+        self.consumer_key = consumer_key
+        self.consumer_secret = consumer_secret
+        self.access_token = access_token
+        self.access_token_secret = access_token_secret
+        self.signature = HmacSha1Signature()
+
+    @classmethod
+    def from_session(cls, session):
+        """Signer with the tokens of an authenticated rauth OAuth1Session"""
+        return cls(session.consumer_key, session.consumer_secret, session.access_token, session.access_token_secret)
+
+    def update(self, session):
+        """Sign with the tokens of a newly authorized session from now on"""
+        self.access_token = session.access_token
+        self.access_token_secret = session.access_token_secret
+
+    def header(self, method, url, params=None):
+        """Authorization header value for a request"""
+        oauth_params = {
+            "oauth_consumer_key": self.consumer_key,
+            "oauth_nonce": sha1(str(random()).encode('ascii')).hexdigest(),
+            "oauth_signature_method": self.signature.NAME,
+            "oauth_timestamp": int(time.time()),
+            "oauth_token": self.access_token,
+            "oauth_version": "1.0",
+        }
+        oauth_params["oauth_signature"] = self.signature.sign(self.consumer_secret, self.access_token_secret,
+                                                              method, url, oauth_params, {"params": params or {}})
+        return 'OAuth ' + ','.join(['realm=""'] + ['{}="{}"'.format(k, quote(str(v), safe=''))
+                                                   for k, v in oauth_params.items()])
+
+
+class AsyncClient:
+    def __init__(self, signer, base_url, account_id, http=None, connections=8, tracker=None):
+        """
+        Asynchronous counterpart of Account on a pooled keep-alive HTTP session
+
+        :param signer: OAuth1Signer of the authenticated session
+        :param http: aiohttp.ClientSession to share between clients, created on first request if None
+        :param connections: size of the connection pool when the client creates its own session
+        :param tracker: PortfolioTracker to continue from, a new one if None
+        """
+        self.signer = signer
+        self.base_url = base_url
+        self.account_id = account_id
+        self.http = http
+        self.owns_http = http is None
+        self.connections = connections
+        self.tracker = tracker if tracker is not None else PortfolioTracker()
+        self.quotes = QuoteEngine(self, [self.tracker])
+        self.account = None
+        self.account_lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, type, value, traceback):
+        await self.close()
+
+    async def close(self):
+        if self.owns_http and self.http is not None:
+            await self.http.close()
+            self.http = None
+
+    async def request(self, path, params=None, headers=None):
+        """
+        Signed GET request to an API endpoint
+
+        :return: parsed JSON body, None for 204 No Content
+        """
+        if self.http is None:
+            import aiohttp  # slow to import, loaded by the first request on the worker thread
+            connector = aiohttp.TCPConnector(limit=self.connections, keepalive_timeout=60)
+            self.http = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=30))
+
+        url = self.base_url + path
+        headers = dict(headers or {})
+        headers["Authorization"] = self.signer.header("GET", url, params)
+        logger.debug("Request url: %s", url)
+
+        endpoint = endpoint_name(path, params)
+        metric = endpoint_metric(endpoint)
+        with metrics.timer("http " + metric):
+            async with self.http.get(url, params=params, headers=headers) as response:
+                body = await response.read()
+        metrics.count("bytes received", len(body))
+        metrics.count("bytes " + metric, len(body))
+        metrics.count("status {}".format(response.status))
+        if response.status == 204:
+            return None
+        if response.status != 200:
+            logger.debug("Response Body: %s", body)
+            message = "API service error"
+            data = loads(body) if body and response.content_type == "application/json" else None
+            if isinstance(data, dict) and (data.get("Error") or {}).get("message") is not None:
+                message = data["Error"]["message"]
+            raise ApiError(response.status, message)
+        return get_capture()(endpoint, body)
+
+    async def get_account(self):
+        """Retrieve the account with account_id from the account list"""
+        self.account = find_account(await self.request("/v1/accounts/list.json"), self.account_id)
+        if self.account is None:
+            raise ApiError(200, "Account {} not found".format(self.account_id))
+        return self.account
+
+    async def ensure_account(self):
+        """Look the account up once, even when several endpoints are fetched concurrently"""
+        async with self.account_lock:
+            if self.account is None:
+                await self.get_account()
+        return self.account
+
+    async def get_portfolio(self):
+        """
+        Retrieve the positions held in the account, fetching the pages after the first concurrently
+
+        :return: list of Position objects, None if there are no positions
+        """
+        await self.ensure_account()
+
+        path = "/v1/accounts/" + self.account["accountIdKey"] + "/portfolio.json"
+        params = {"view": "COMPLETE", "count": PAGE_SIZE}
+
+        data = await self.request(path, params)
+        portfolio = get_positions(data)
+        if portfolio is None:
+            return None
+
+        pages = max([p.get("totalPages", 1) for p in data["PortfolioResponse"]["AccountPortfolio"]] + [1])
+        if pages > 1:
+            rest = await asyncio.gather(*[self.request(path, dict(params, pageNumber=n)) for n in range(2, pages + 1)])
+            for page in rest:
+                portfolio.extend(get_positions(page) or [])
+
+        return self.tracker.update(portfolio)
+
+    def prime(self, rows):
+        """
+        Start from stored leg rows until the first portfolio fetch
+
+        :param rows: dict of account -> extract_rows() tuples
+        :return: list of Position objects
+        """
+        return self.tracker.update_rows(rows.get(self.account_id, []))
+
+    async def get_balance(self):
+        """Retrieve the current balance of the account"""
+        await self.ensure_account()
+
+        path = "/v1/accounts/" + self.account["accountIdKey"] + "/balance.json"
+        params = {"instType": self.account["institutionType"], "realTimeNAV": "true"}
+        return get_balance_data(await self.request(path, params, {"consumerkey": self.signer.consumer_key}))
+
+    async def get_quotes(self, symbols):
+        """Retrieve quotes for any number of symbols, in concurrent batches of QUOTE_BATCH"""
+        batches = [symbols[i:i + QUOTE_BATCH] for i in range(0, len(symbols), QUOTE_BATCH)]
+        params = {"detailFlag": "ALL", "overrideSymbolCount": "true"}
+        results = await asyncio.gather(*[self.request(quote_path(b), params) for b in batches])
+        quotes = []
+        for data in results:
+            quotes.extend(get_quote_data(data) or [])
+        return quotes
+
+    async def get_marks(self):
+        """
+        Refresh the quotes of the held contracts and recompute their gains locally
+
+        :return: set of group keys whose positions changed
+        """
+        return await self.quotes.refresh()
+
+    async def refresh(self):
+        """Fetch portfolio and balance concurrently"""
+        return await asyncio.gather(self.get_portfolio(), self.get_balance())
@@ -0,0 +1,140 @@
+import datetime
+import math
+
+import numpy as np
+
+from accounts.portfolio import LEG_COLUMNS, RISK_COLUMNS
+from settings import *
+
+IV, DELTA, GAMMA, THETA, VEGA = range(len(LEG_COLUMNS) - len(RISK_COLUMNS), len(LEG_COLUMNS))
+MIN_VOL, MAX_VOL = 1e-3, 5.0
+IV_ITERATIONS = 30
+IV_TOLERANCE = 1e-3  # largest price error per share of a solved implied volatility
+CLOSE_HOUR = 16  # options expire at the close
+
+
+def erf(x):
+    """Abramowitz and Stegun 7.1.26, absolute error below 1.5e-7"""
+    sign = np.sign(x)
+    x = np.abs(x)
+    t = 1.0 / (1.0 + 0.3275911 * x)
+    y = 1.0 - ((((1.061405429 * t - 1.453152027) * t + 1.421413741) * t - 0.284496736) * t + 0.254829592) \
+        * t * np.exp(-x * x)
+    return sign * y
+
+
+def norm_cdf(x):
+    return 0.5 * (1.0 + erf(x / math.sqrt(2.0)))
+
+
+def norm_pdf(x):
+    return np.exp(-0.5 * x * x) / math.sqrt(2.0 * math.pi)
+
+
+def black_scholes(spot, strike, years, rate, vol, call):
+    """
+    Black-Scholes price and greeks of European options, all arguments are arrays of the same shape
+
+    :param call: boolean array, False for puts
+    :return: (price, delta, gamma, theta per day, vega per vol point), per share
+    """
+    root = np.sqrt(years)
+    d1 = (np.log(spot / strike) + (rate + 0.5 * vol * vol) * years) / (vol * root)
+    d2 = d1 - vol * root
+    discount = strike * np.exp(-rate * years)
+    pdf = norm_pdf(d1)
+
+    nd1, nd2 = norm_cdf(d1), norm_cdf(d2)
+    price = np.where(call, spot * nd1 - discount * nd2, discount * (1.0 - nd2) - spot * (1.0 - nd1))
+    delta = np.where(call, nd1, nd1 - 1.0)
+    gamma = pdf / (spot * vol * root)
+    decay = -spot * pdf * vol / (2.0 * root)
+    theta = np.where(call, decay - rate * discount * nd2, decay + rate * discount * (1.0 - nd2)) / 365.0
+    vega = spot * pdf * root / 100.0
+    return price, delta, gamma, theta, vega
+
+
+def implied_vol(price, spot, strike, years, rate, call):
+    """
+    Implied volatility by safeguarded Newton iterations, NaN where the price has no solution
+
+    Each step is a Newton step on the Black-Scholes price, replaced by bisection of the bracket
+    when it would leave it, so every element converges within IV_ITERATIONS. A price outside the
+    prices at MIN_VOL and MAX_VOL ends up at an edge of the bracket without matching, so only a
+    volatility that reprices the option within IV_TOLERANCE counts as solved.
+    """
+    low = np.full(price.shape, MIN_VOL)
+    high = np.full(price.shape, MAX_VOL)
+    vol = np.full(price.shape, 0.3)
+    for _ in range(IV_ITERATIONS):
+        model, _, _, _, vega = black_scholes(spot, strike, years, rate, vol, call)
+        diff = model - price
+        high = np.where(diff > 0, vol, high)
+        low = np.where(diff > 0, low, vol)
+        with np.errstate(all="ignore"):
+            step = vol - diff / (vega * 100.0)
+        vol = np.where((step > low) & (step < high), step, 0.5 * (low + high))
+
+    model = black_scholes(spot, strike, years, rate, vol, call)[0]
+    intrinsic = np.maximum(np.where(call, spot - strike * np.exp(-rate * years), strike * np.exp(-rate * years)
+                                    - spot), 0.0)
+    solved = (price > intrinsic) & (price < np.where(call, spot, strike)) & (np.abs(model - price) < IV_TOLERANCE)
+    return np.where(solved, vol, np.nan)
+
+
+def years_to_expiry(ordinals, now=None):
+    """Years from now to the close of each expiry date, at least one minute"""
+    now = now or datetime.datetime.now()
+    days = ordinals - now.toordinal() + (CLOSE_HOUR - now.hour - now.minute / 60.0) / 24.0
+    return np.maximum(days, 1.0 / 1440.0) / 365.0
+
+
+class RiskEngine:
+    def __init__(self, rate=None):
+        """
+        Implied volatility and greeks of legs, computed in one NumPy pass over LegStore columns
+
+        Values are written to the risk columns of the store as position totals: greeks are scaled
+        by quantity and the 100 share multiplier, so spreads and positions only have to sum them.
+
+        :param rate: risk free rate, [RISK] RATE in config.ini if None
+        """
+        self.rate = config.getfloat("RISK", "RATE", fallback=0.04) if rate is None else rate
+
+    def update(self, store, rows, spots, now=None):
+        """
+        Recompute the risk columns of some legs from their bid/ask
+
+        :param store: LegStore of the legs
+        :param rows: store rows to recompute
+        :param spots: dict of underlying symbol -> price
+        """
+        if not rows:
+            return
+        rows = np.fromiter(rows, dtype=np.int64, count=len(rows))
+        symbols, types = store.columns[1], store.columns[2]
+        spot = np.array([spots.get(symbols[i], np.nan) for i in rows.tolist()])
+        call = np.array([types[i] == "CALL" for i in rows.tolist()])
+
+        def column(c):
+            return np.frombuffer(store.columns[c], dtype=store.columns[c].typecode)
+
+        strike = column(3)[rows]
+        quantity = column(5)[rows] * 100.0
+        years = years_to_expiry(column(4)[rows], now)
+        bid, ask = column(11)[rows], column(12)[rows]
+        mark = np.where((bid > 0) | (ask > 0), (bid + ask) / 2, np.nan)
+
+        with np.errstate(all="ignore"):
+            vol = implied_vol(mark, spot, strike, years, self.rate, call)
+            _, delta, gamma, theta, vega = black_scholes(spot, strike, years, self.rate, vol, call)
+
+        # Views into the arrays are dropped before anything can resize them
+        column(IV)[rows] = vol
+        for c, values in ((DELTA, delta), (GAMMA, gamma), (THETA, theta), (VEGA, vega)):
+            column(c)[rows] = values * quantity
+
+        for owner in set(store.owners[i] for i in rows.tolist()):
+            if owner is not None:
+                owner.invalidate()
+
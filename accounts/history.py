@@ -0,0 +1,187 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from accounts.portfolio import ROW_COLUMNS
+from settings import *
+
+LEG_FIELDS = tuple(name for name, _ in ROW_COLUMNS)
+THIN_AFTER = 24 * 3600  # seconds, older snapshots are thinned to one per THIN_TO per account
+THIN_TO = 3600  # seconds
+COMPACT_EVERY = 50  # appends between size checks
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (id INTEGER PRIMARY KEY, ts REAL NOT NULL, account TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS snapshots_account ON snapshots (account, ts);
+CREATE TABLE IF NOT EXISTS legs (snapshot INTEGER NOT NULL, account TEXT NOT NULL, ts REAL NOT NULL, {});
+CREATE INDEX IF NOT EXISTS legs_snapshot ON legs (snapshot);
+CREATE INDEX IF NOT EXISTS legs_history ON legs (account, symbol, date, ts);
+CREATE TABLE IF NOT EXISTS balances (ts REAL NOT NULL, account TEXT NOT NULL, body TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS balances_account ON balances (account, ts);
+""".format(", ".join(LEG_FIELDS))
+
+
+def portfolio_rows(portfolio, account):
+    """
+    Stored rows of the legs of a portfolio, in extract_rows() order
+
+    :param portfolio: list of Position, or AggregatePosition holding positions of several accounts
+    :param account: account of plain Positions
+    :return: dict of account -> list of row tuples
+    """
+    width = len(ROW_COLUMNS)
+    rows = {}
+    for position in portfolio:
+        for owner, p in getattr(position, "positions", [(account, position)]):
+            with p.legs[0].store.lock:  # runs beside the refresh thread, which updates legs in place
+                rows.setdefault(owner, []).extend(tuple(leg.store.row(leg.index)[:width]) for leg in p.legs)
+    return rows
+
+
+class SnapshotStore:
+    def __init__(self, path, max_bytes=500 * 1024 * 1024, interval=60.0):
+        """
+        Portfolio and balance history in a SQLite file
+
+        Every stored portfolio is a snapshot of leg rows, indexed by (account, symbol, expiry,
+        time) for history queries. The last snapshot of each account is loaded at startup so the
+        first frame does not wait for the API. Once the file holds more than max_bytes of data,
+        snapshots older than a day are thinned to one per hour, then the oldest are dropped.
+
+        :param path: database file, created if missing
+        :param max_bytes: size the data is compacted under
+        :param interval: least seconds between stored snapshots of an account
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.last = {}  # (table, account) -> time of the last stored row
+        self.appends = 0
+        self.lock = threading.Lock()
+
+        new = not os.path.exists(path)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        if new:
+            self.db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        self.db.executescript(SCHEMA)
+
+    @classmethod
+    def from_config(cls):
+        """Store set up from the [SNAPSHOTS] section of config.ini, None if PATH is empty"""
+        path = config.get("SNAPSHOTS", "PATH", fallback="snapshots.db")
+        if not path:
+            return None
+        return cls(path, int(config.getfloat("SNAPSHOTS", "MAX_MB", fallback=500) * 1024 * 1024),
+                   config.getfloat("SNAPSHOTS", "INTERVAL", fallback=60.0))
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def due(self, table, account, now):
+        last = self.last.get((table, account))
+        if last is not None and now - last < self.interval:
+            return False
+        self.last[table, account] = now
+        return True
+
+    def append_portfolio(self, rows, now=None):
+        """
+        Store a snapshot per account, skipping accounts stored less than interval seconds ago
+
+        :param rows: dict of account -> leg rows, see portfolio_rows
+        """
+        now = time.time() if now is None else now
+        with self.lock, self.db:
+            for account, legs in rows.items():
+                if not self.due("legs", account, now):
+                    continue
+                snapshot = self.db.execute("INSERT INTO snapshots (ts, account) VALUES (?, ?)",
+                                           (now, account)).lastrowid
+                self.db.executemany("INSERT INTO legs VALUES ({})".format(", ".join("?" * (len(LEG_FIELDS) + 3))),
+                                    [(snapshot, account, now) + row for row in legs])
+                self.appends += 1
+        if self.appends >= COMPACT_EVERY:
+            self.appends = 0
+            self.compact()
+
+    def append_balance(self, balance, account, now=None):
+        """Store a balance, or a dict of account -> balance of all accounts"""
+        now = time.time() if now is None else now
+        if not self.due("balances", account, now):
+            return
+        with self.lock, self.db:
+            self.db.execute("INSERT INTO balances VALUES (?, ?, ?)", (now, account, json.dumps(balance)))
+
+    def load_last(self):
+        """
+        Latest stored snapshot of every account
+
+        :return: dict of account -> (time, leg rows)
+        """
+        with self.lock:
+            latest = self.db.execute("SELECT account, MAX(id), ts FROM snapshots GROUP BY account").fetchall()
+            return {account: (ts, self.db.execute("SELECT {} FROM legs WHERE snapshot = ?".format(
+                ", ".join(LEG_FIELDS)), (snapshot,)).fetchall()) for account, snapshot, ts in latest}
+
+    def load_balance(self, account):
+        """Latest stored balance of account, None if there is none"""
+        with self.lock:
+            row = self.db.execute("SELECT body FROM balances WHERE account = ? ORDER BY ts DESC LIMIT 1",
+                                  (account,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def history(self, account, symbol, expiry=None, since=None):
+        """
+        Day and total gain of an underlying at every stored snapshot
+
+        :param expiry: date ordinal to restrict to one expiry, all expiries if None
+        :param since: earliest time, all history if None
+        :return: list of (time, days_gain, total_gain)
+        """
+        query = "SELECT ts, SUM(daysGain), SUM(totalGain) FROM legs WHERE account = ? AND symbol = ?"
+        params = [account, symbol]
+        if expiry is not None:
+            query += " AND date = ?"
+            params.append(expiry)
+        if since is not None:
+            query += " AND ts >= ?"
+            params.append(since)
+        with self.lock:
+            return self.db.execute(query + " GROUP BY ts ORDER BY ts", params).fetchall()
+
+    def size(self):
+        """Bytes of the file in use, free pages excluded"""
+        pages, free, page_size = (self.db.execute("PRAGMA " + p).fetchone()[0]
+                                  for p in ("page_count", "freelist_count", "page_size"))
+        return (pages - free) * page_size
+
+    def compact(self, now=None):
+        """Thin and drop old snapshots until the data fits in max_bytes"""
+        now = time.time() if now is None else now
+        with self.lock:
+            if self.size() <= self.max_bytes:
+                return
+            with self.db:
+                # Keep the first snapshot of every hour per account once they are a day old
+                self.db.execute("""DELETE FROM snapshots WHERE ts < ? AND id NOT IN (
+                                       SELECT MIN(id) FROM snapshots GROUP BY account, CAST(ts / ? AS INTEGER))""",
+                                (now - THIN_AFTER, THIN_TO))
+                self.db.execute("DELETE FROM legs WHERE snapshot NOT IN (SELECT id FROM snapshots)")
+            self.db.execute("PRAGMA incremental_vacuum")
+
+            while self.size() > self.max_bytes * 0.9:
+                oldest = self.db.execute("SELECT MIN(ts) FROM snapshots").fetchone()[0]
+                newest = self.db.execute("SELECT MAX(ts) FROM snapshots").fetchone()[0]
+                if oldest is None or oldest == newest:
+                    break
+                cut = oldest + (newest - oldest) / 10  # the oldest tenth of the time span
+                with self.db:
+                    self.db.execute("DELETE FROM snapshots WHERE ts < ?", (cut,))
+                    self.db.execute("DELETE FROM legs WHERE ts < ?", (cut,))
+                    self.db.execute("DELETE FROM balances WHERE ts < ?", (cut,))
+                self.db.execute("PRAGMA incremental_vacuum")
@@ -0,0 +1,183 @@
+import asyncio
+import time
+
+from accounts.account import get_accounts
+from accounts.client import AsyncClient
+from accounts.portfolio import sum_risk
+from accounts.quotes import QuoteEngine
+from accounts.tracker import PortfolioTracker
+
+
+class AggregatePosition:
+    """Positions of the same underlying and expiry across accounts, shown as one row"""
+    __slots__ = ('positions', 'date', 'symbol', 'show_spreads')
+
+    def __init__(self, key, positions):
+        """
+        :param key: (date, symbol)
+        :param positions: list of (account_id, Position)
+        """
+        self.date, self.symbol = key
+        self.positions = positions
+        self.show_spreads = False
+
+    @property
+    def accounts(self):
+        return [account_id for account_id, _ in self.positions]
+
+    @property
+    def spreads(self):
+        return [s for _, p in self.positions for s in p.spreads]
+
+    @property
+    def legs(self):
+        return [leg for _, p in self.positions for leg in p.legs]
+
+    @property
+    def strategy(self):
+        strategies = set(p.strategy for _, p in self.positions)
+        strategy = strategies.pop() if len(strategies) == 1 else "Mixed"
+        if len(self.positions) > 1:
+            strategy += " x{}".format(len(self.positions))
+        return strategy
+
+    days_gain = property(lambda self: round(sum(p.days_gain for _, p in self.positions), 2))
+    days_gain_pct = property(lambda self: round(sum(p.days_gain_pct for _, p in self.positions), 2))
+    total_gain = property(lambda self: round(sum(p.total_gain for _, p in self.positions), 2))
+    total_gain_pct = property(lambda self: round(sum(p.total_gain_pct for _, p in self.positions), 2))
+
+    def risk(self):
+        return sum_risk(p.risk() for _, p in self.positions)
+
+    delta = property(lambda self: self.risk()[0])
+    gamma = property(lambda self: self.risk()[1])
+    theta = property(lambda self: self.risk()[2])
+    vega = property(lambda self: self.risk()[3])
+
+
+class MultiAccount:
+    def __init__(self, signer, base_url, wait=1.0, connections=16):
+        """
+        Fetches every open account concurrently on one shared session
+
+        The account list is fetched once. Each refresh starts a fetch for every account that has
+        none in flight and waits at most wait seconds; accounts still loading keep their previous
+        positions until their fetch completes, so one slow account does not hold up the others.
+
+        :param signer: OAuth1Signer of the authenticated session
+        :param wait: seconds to wait for slow accounts before publishing
+        :param connections: size of the shared connection pool
+        """
+        self.lister = AsyncClient(signer, base_url, None, connections=connections)
+        self.signer = signer
+        self.base_url = base_url
+        self.wait = wait
+        self.accounts = None  # open accounts from the account list
+        self.clients = {}  # accountId -> AsyncClient sharing the lister's session
+        self.pending = {}  # accountId -> portfolio fetch task in flight
+        self.portfolios = {}  # accountId -> list of Position
+        self.latency = {}  # accountId -> seconds the last fetch took
+        self.errors = {}  # accountId -> message of the last failed fetch
+        self.groups = {}  # (date, symbol) -> AggregatePosition
+        self.quotes = QuoteEngine(self.lister, [])  # one set of quote batches for all accounts
+        self.trackers = {}  # accountId -> PortfolioTracker primed from stored rows
+
+    async def close(self):
+        for task in self.pending.values():
+            task.cancel()
+        await self.lister.close()
+
+    async def get_account(self):
+        """Retrieve the account list once and set up a client per open account"""
+        if self.accounts is None:
+            self.accounts = get_accounts(await self.lister.request("/v1/accounts/list.json")) or []
+            for account in self.accounts:
+                client = AsyncClient(self.signer, self.base_url, account["accountId"], http=self.lister.http,
+                                     tracker=self.trackers.pop(account["accountId"], None))
+                client.account = account
+                self.clients[account["accountId"]] = client
+                self.quotes.trackers.append(client.tracker)
+        return self.accounts
+
+    def prime(self, rows):
+        """
+        Start from stored leg rows until each account's first portfolio fetch
+
+        :param rows: dict of accountId -> extract_rows() tuples
+        :return: list of AggregatePosition
+        """
+        for account_id, legs in rows.items():
+            tracker = self.trackers[account_id] = PortfolioTracker()
+            self.portfolios[account_id] = tracker.update_rows(legs)
+        return self.aggregate()
+
+    async def fetch(self, account_id):
+        start = time.perf_counter()
+        try:
+            self.portfolios[account_id] = await self.clients[account_id].get_portfolio() or []
+            self.errors.pop(account_id, None)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.errors[account_id] = str(e) or type(e).__name__
+        self.latency[account_id] = time.perf_counter() - start
+
+    async def get_portfolio(self):
+        """
+        Refresh the portfolios of all accounts
+
+        :return: list of AggregatePosition grouped by expiry and underlying across accounts
+        """
+        await self.get_account()
+        for account_id in self.clients:
+            if account_id not in self.pending:
+                self.pending[account_id] = asyncio.create_task(self.fetch(account_id))
+
+        if self.pending:  # no open accounts leaves nothing to wait for
+            await asyncio.wait(list(self.pending.values()), timeout=self.wait)
+        for account_id in [a for a, task in self.pending.items() if task.done()]:
+            del self.pending[account_id]
+        return self.aggregate()
+
+    async def get_marks(self):
+        """Refresh the quotes of the contracts held in any account and recompute their gains"""
+        await self.get_account()
+        return await self.quotes.refresh()
+
+    async def get_balance(self):
+        """Balances of all accounts, by accountId"""
+        await self.get_account()
+        ids = list(self.clients)
+        results = await asyncio.gather(*[self.clients[a].get_balance() for a in ids], return_exceptions=True)
+        return {a: b for a, b in zip(ids, results) if not isinstance(b, Exception)}
+
+    def aggregate(self):
+        """Group the positions of all accounts by (date, symbol), keeping expand state"""
+        groups = {}
+        for account_id, portfolio in self.portfolios.items():
+            for position in portfolio:
+                groups.setdefault((position.date, position.symbol), []).append((account_id, position))
+
+        aggregates = {}
+        for key in sorted(groups):
+            aggregate = AggregatePosition(key, groups[key])
+            old = self.groups.get(key)
+            if old is not None:
+                aggregate.show_spreads = old.show_spreads
+            aggregates[key] = aggregate
+        self.groups = aggregates
+        return list(aggregates.values())
+
+    def status(self):
+        """One line of fetch latency or error per account"""
+        lines = []
+        for account in self.accounts or []:
+            account_id = account["accountId"]
+            name = account.get("accountDesc") or account_id[-4:]
+            if account_id in self.errors:
+                lines.append("{}: {}".format(name, self.errors[account_id]))
+            elif account_id in self.pending and account_id not in self.portfolios:
+                lines.append("{}: loading".format(name))
+            elif account_id in self.latency:
+                lines.append("{}: {:.0f} ms".format(name, self.latency[account_id] * 1e3))
+        return lines
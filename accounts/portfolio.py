@@ -1,59 +1,327 @@
+import datetime
+import math
+import sys
+import threading
+from array import array
+from collections import deque
+
+from accounts.strategy import STOCK, classify, classify_symbol
+
+# Leg fields in extract_rows() order, with the array typecode they are stored as (None for a list)
+ROW_COLUMNS = (('positionId', 'q'), ('symbol', None), ('callPut', None), ('strikePrice', 'd'), ('date', 'l'),
+               ('quantity', 'q'), ('pricePaid', 'd'), ('daysGain', 'd'), ('daysGainPct', 'd'),
+               ('totalGain', 'd'), ('totalGainPct', 'd'), ('bid', 'd'), ('ask', 'd'))
+# Computed by the RiskEngine, NaN until the leg is quoted
+RISK_COLUMNS = (('iv', 'd'), ('delta', 'd'), ('gamma', 'd'), ('theta', 'd'), ('vega', 'd'))
+LEG_COLUMNS = ROW_COLUMNS + RISK_COLUMNS
+UNSET = [math.nan] * len(RISK_COLUMNS)
+QUOTED = 7  # first of the gain and bid/ask columns a QuoteEngine recomputes
+STOCK_DATE = datetime.date.max  # date of stock legs, their groups sort after every expiry
+
+
+class LegStore:
+    """
+    Legs stored column by column in compact arrays, read through Leg views
+
+    Each row also remembers the Position built over it, so updating a leg drops the cached
+    aggregates of that position and its spreads.
+
+    Once a QuoteEngine has priced a leg, its gains and bid/ask are computed from fresher quotes
+    than the portfolio response has, so update() keeps them.
+
+    Legs are updated in place on the refresh thread while the UI reads them. Writers hold lock
+    across a change and the invalidation it causes, and Spread and Position compute and cache
+    their aggregates under it, so a cached value is never computed from columns that changed
+    after it was dropped.
+    """
+
+    def __init__(self):
+        self.columns = [array(code) if code else [] for _, code in LEG_COLUMNS]
+        self.owners = []  # row -> Position over the leg
+        self.free = []  # rows of removed legs, reused by add
+        self.quoted = set()  # rows whose columns from QUOTED on are set by a QuoteEngine
+        self.lock = threading.RLock()
+        self.dates = {}  # ordinal -> shared datetime.date
+
+    def __len__(self):
+        return len(self.owners) - len(self.free)
+
+    @staticmethod
+    def prepare(row):
+        """Native values of an extract_rows() tuple, as they are stored"""
+        row = list(row)
+        row[1] = sys.intern(row[1])
+        row[2] = sys.intern(row[2])
+        row[3] = float(row[3])
+        row[5] = int(row[5])
+        return row
+
+    @classmethod
+    def new_row(cls, row):
+        """Full row of a new leg, risk columns unset"""
+        return cls.prepare(row) + UNSET
+
+    def add(self, row):
+        """Store an extract_rows() tuple and return its Leg"""
+        row = self.new_row(row)
+        if self.free:
+            i = self.free.pop()
+            for column, value in zip(self.columns, row):
+                column[i] = value
+            self.owners[i] = None
+        else:
+            i = len(self.owners)
+            for column, value in zip(self.columns, row):
+                column.append(value)
+            self.owners.append(None)
+        return Leg(self, i)
+
+    def extend(self, rows):
+        """Store extract_rows() tuples in bulk and return their Legs"""
+        start = len(self.owners)
+        for column, values in zip(self.columns, zip(*map(self.new_row, rows))):
+            column.extend(values)
+        self.owners.extend([None] * len(rows))
+        return [Leg(self, i) for i in range(start, len(self.owners))]
+
+    def row(self, i):
+        return [column[i] for column in self.columns]
+
+    def update(self, i, row):
+        """
+        Overwrite a leg with a new extract_rows() tuple, up to QUOTED if the leg is quoted
+
+        :return: the previous values of the leg, None if nothing changed
+        """
+        width = QUOTED if i in self.quoted else len(row)
+        for column, value in zip(self.columns[:width], row):
+            if column[i] != value:
+                break
+        else:
+            return None
+
+        old = self.row(i)
+        for column, value in zip(self.columns[:width], self.prepare(row)):
+            column[i] = value
+        if self.owners[i] is not None:
+            self.owners[i].invalidate()
+        return old
+
+    def set(self, i, values):
+        """
+        Overwrite some columns of a leg
+
+        :param values: dict of column index -> new value
+        :return: True if any value changed
+        """
+        changed = False
+        for c, value in values.items():
+            column = self.columns[c]
+            if column[i] != value:
+                column[i] = value
+                changed = True
+        if changed and self.owners[i] is not None:
+            self.owners[i].invalidate()
+        return changed
+
+    def remove(self, i):
+        self.owners[i] = None
+        self.quoted.discard(i)
+        self.free.append(i)
+
+    def date(self, ordinal):
+        date = self.dates.get(ordinal)
+        if date is None:
+            date = self.dates[ordinal] = datetime.date.fromordinal(ordinal)
+        return date
+
+
+def _column(c):
+    return property(lambda self: self.store.columns[c][self.index])
+
+
+def sum_risk(risks):
+    """Sum (delta, gamma, theta, vega) tuples, skipping legs without a quote"""
+    totals = [math.nan] * 4
+    for risk in risks:
+        for n, value in enumerate(risk):
+            if value == value:
+                totals[n] = value if totals[n] != totals[n] else totals[n] + value
+    return tuple(totals)
+
+
+def _rounded(c):
+    """Gains are rounded to cents, like E*TRADE shows them"""
+    return property(lambda self: round(self.store.columns[c][self.index], 2))
+
+
+class Leg:
+    """One leg, a view of a row of a LegStore"""
+    __slots__ = ('store', 'index')
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    id = _column(0)
+    symbol = _column(1)
+    option_type = _column(2)
+    strike = _column(3)
+    quantity = _column(5)
+    price_paid = _column(6)
+    days_gain = _rounded(7)
+    days_gain_pct = _rounded(8)
+    total_gain = _rounded(9)
+    total_gain_pct = _rounded(10)
+    bid = _column(11)
+    ask = _column(12)
+    iv = _column(13)
+    delta = _column(14)
+    gamma = _column(15)
+    theta = _column(16)
+    vega = _column(17)
+
+    def risk(self):
+        return self.delta, self.gamma, self.theta, self.vega
+
+    @property
+    def date(self):
+        return self.store.date(self.store.columns[4][self.index])
+
+
 class Spread:
-    def __init__(self, leg1, leg2):
-        self.leg1 = leg1  # Leg(leg1)
-        self.leg2 = leg2  # Leg(leg2)
-
-        self.date = self.leg1.date
-        self.symbol = self.leg1.symbol
-        self.quantity = abs(self.leg1.quantity)
-        self.option_type = self.leg1.option_type
-        self.direction = self.get_direction()
-        self.strikes = (self.leg1.strike, self.leg2.strike)
-        self.days_gain, self.days_gain_pct = self.get_days_gain()
-        self.total_gain, self.total_gain_pct = self.get_total_gain()
-        self.price_paid = self.get_price_paid()
+    __slots__ = ('leg1', 'leg2', 'quantity', 'show_legs', '_aggregates', '_risk')
+
+    def __init__(self, leg1, leg2, quantity=None):
+        """
+        :param leg1: lower strike leg
+        :param leg2: higher strike leg
+        :param quantity: number of spreads, may cover only part of the legs, all of leg1 if None
+        """
+        self.leg1 = leg1
+        self.leg2 = leg2
+        self.quantity = abs(self.leg1.quantity) if quantity is None else quantity
         self.show_legs = False
+        self._aggregates = None
+        self._risk = None
+
+    date = property(lambda self: self.leg1.date)
+    symbol = property(lambda self: self.leg1.symbol)
+    option_type = property(lambda self: self.leg1.option_type)
+    strikes = property(lambda self: (self.leg1.strike, self.leg2.strike))
+    direction = property(lambda self: self.get_direction())
+
+    def invalidate(self):
+        self._aggregates = None
+        self._risk = None
+
+    def aggregates(self):
+        """(days_gain, days_gain_pct, total_gain, total_gain_pct, price_paid), cached until a leg updates"""
+        aggregates = self._aggregates
+        if aggregates is None:
+            with self.leg1.store.lock:
+                aggregates = self._aggregates = self.get_days_gain() + self.get_total_gain() + \
+                                                (self.get_price_paid(),)
+        return aggregates
+
+    days_gain = property(lambda self: self.aggregates()[0])
+    days_gain_pct = property(lambda self: self.aggregates()[1])
+    total_gain = property(lambda self: self.aggregates()[2])
+    total_gain_pct = property(lambda self: self.aggregates()[3])
+    price_paid = property(lambda self: self.aggregates()[4])
+
+    def risk(self):
+        """(delta, gamma, theta, vega) of the spread's share of its legs, cached until a leg updates"""
+        risk = self._risk
+        if risk is None:
+            with self.leg1.store.lock:
+                s1, s2 = self.share(self.leg1), self.share(self.leg2)
+                risk = self._risk = sum_risk([tuple(v * s1 for v in self.leg1.risk()),
+                                              tuple(v * s2 for v in self.leg2.risk())])
+        return risk
+
+    delta = property(lambda self: self.risk()[0])
+    gamma = property(lambda self: self.risk()[1])
+    theta = property(lambda self: self.risk()[2])
+    vega = property(lambda self: self.risk()[3])
 
     def get_direction(self):
-        return "debit" if self.leg1.quantity < self.leg2.quantity and self.leg1.option_type == "PUT" else "credit"
+        """Debit when long the lower strike call or the higher strike put"""
+        long_leg = self.leg1 if self.option_type == "CALL" else self.leg2
+        return "debit" if long_leg.quantity > 0 else "credit"
+
+    def share(self, leg):
+        """Fraction of the leg that belongs to this spread"""
+        return self.quantity / abs(leg.quantity)
 
     def get_days_gain(self):
-        return round(self.leg1.days_gain + self.leg2.days_gain, 2), \
+        s1, s2 = self.share(self.leg1), self.share(self.leg2)
+        return round(self.leg1.days_gain * s1 + self.leg2.days_gain * s2, 2), \
                round(self.leg1.days_gain_pct + self.leg2.days_gain_pct, 2)
 
     def get_total_gain(self):
-        return round(self.leg1.total_gain + self.leg2.total_gain, 2), \
+        s1, s2 = self.share(self.leg1), self.share(self.leg2)
+        return round(self.leg1.total_gain * s1 + self.leg2.total_gain * s2, 2), \
                round(self.leg1.total_gain_pct + self.leg2.total_gain_pct, 2)
 
     def get_price_paid(self):
-        return round((self.leg1.price_paid * self.leg1.quantity + self.leg2.price_paid * self.leg2.quantity) * 100, 2)
-
-
-class Leg:
-    def __init__(self, leg):
-        self.id = leg['positionId']
-        self.date = leg['Date']
-        self.symbol = leg['symbol']
-        self.quantity = leg['quantity']
-        self.option_type = leg['callPut']
-        self.strike = leg['strikePrice']
-        self.days_gain = round(leg['daysGain'], 2)
-        self.days_gain_pct = round(leg['daysGainPct'], 2)
-        self.total_gain = round(leg['totalGain'], 2)
-        self.total_gain_pct = round(leg['totalGainPct'], 2)
-        self.price_paid = leg['pricePaid']
+        s1, s2 = self.share(self.leg1), self.share(self.leg2)
+        return round((self.leg1.price_paid * self.leg1.quantity * s1 +
+                      self.leg2.price_paid * self.leg2.quantity * s2) * 100, 2)
 
 
 class Position:
-    def __init__(self, title, spreads, legs):
+    __slots__ = ('spreads', 'legs', 'date', 'symbol', 'strategy', 'show_spreads', '_aggregates', '_risk')
+
+    def __init__(self, title, spreads, legs, gains=None):
+        """
+        :param title: (date, symbol) of the position
+        :param gains: precomputed (days_gain, days_gain_pct, total_gain, total_gain_pct), summed from legs if None
+        """
         self.spreads = spreads
         self.legs = legs
         self.date = title[0]
         self.symbol = title[1]
         self.strategy = ""
-        self.days_gain, self.days_gain_pct = self.get_days_gain()
-        self.total_gain, self.total_gain_pct = self.get_total_gain()
         self.show_spreads = False
+        self._aggregates = gains
+        self._risk = None
+
+        for leg in legs:
+            leg.store.owners[leg.index] = self
+
+    def invalidate(self):
+        """Drop the cached aggregates of the position and its spreads"""
+        self._aggregates = None
+        self._risk = None
+        for s in self.spreads:
+            s.invalidate()
+
+    def aggregates(self):
+        """(days_gain, days_gain_pct, total_gain, total_gain_pct), cached until a leg updates"""
+        aggregates = self._aggregates
+        if aggregates is None:
+            with self.legs[0].store.lock:
+                aggregates = self._aggregates = self.get_days_gain() + self.get_total_gain()
+        return aggregates
+
+    days_gain = property(lambda self: self.aggregates()[0])
+    days_gain_pct = property(lambda self: self.aggregates()[1])
+    total_gain = property(lambda self: self.aggregates()[2])
+    total_gain_pct = property(lambda self: self.aggregates()[3])
+
+    def risk(self):
+        """(delta, gamma, theta, vega) summed over the legs, cached until a leg updates"""
+        risk = self._risk
+        if risk is None:
+            with self.legs[0].store.lock:
+                risk = self._risk = sum_risk(leg.risk() for leg in self.legs)
+        return risk
+
+    delta = property(lambda self: self.risk()[0])
+    gamma = property(lambda self: self.risk()[1])
+    theta = property(lambda self: self.risk()[2])
+    vega = property(lambda self: self.risk()[3])
 
     def get_days_gain(self):
         gain = 0
@@ -74,22 +342,87 @@ class Position:
         return round(gain, 2), round(gain_pct, 2)
 
 
-def get_spreads(options_df):
-    groups = options_df.groupby(['Date', 'symbol', 'callPut'])
-    spreads = []
+def pair_legs(strikes, quantities):
+    """
+    Match legs of opposite quantity into spreads
+
+    Legs are walked up by strike. Open (not yet fully paired) legs are indexed by their remaining
+    quantity, so a leg is first matched with the lowest open leg of exactly opposite quantity.
+    Failing that, it takes what it can from the open legs of opposite sign, lowest first, which
+    pairs e.g. 10 long against 5 + 5 short.
+
+    :param strikes: strikes in ascending order
+    :param quantities: signed quantities, same order as strikes
+    :return: list of (i, j, quantity) with i the lower strike index
+    """
+    remaining = list(quantities)
+    by_quantity = {}  # remaining quantity -> open leg indices, entries may be stale
+    by_sign = {True: deque(), False: deque()}  # long / short open leg indices, entries may be stale
+    pairs = []
+
+    for i in range(len(strikes)):
+        q = remaining[i]
+        if not q:
+            continue
 
-    for _, g in groups:
-        g = g.sort_values('strikePrice').reset_index()
-        l = list(g.index)
+        # exact opposite quantity
+        open_legs = by_quantity.get(-q)
+        while open_legs:
+            j = open_legs.popleft()
+            if remaining[j] == -q:
+                pairs.append((j, i, abs(q)))
+                remaining[j] = q = 0
+                break
 
-        for i in g.index:
-            if g.loc[l[0], 'quantity'] + g.loc[i, 'quantity'] == 0:
-                q = g.loc[l[0], 'quantity']
-                s = Spread(Leg(g.loc[l[0], :]), Leg(g.loc[i, :]))
+        # partial quantities against the opposite side
+        pool = by_sign[q < 0]
+        while q and pool:
+            j = pool[0]
+            if not remaining[j]:
+                pool.popleft()
+                continue
+            n = min(abs(q), abs(remaining[j]))
+            pairs.append((j, i, n))
+            remaining[j] += n if remaining[j] < 0 else -n
+            q += n if q < 0 else -n
+            if remaining[j]:
+                by_quantity.setdefault(remaining[j], deque()).append(j)
+            else:
+                pool.popleft()
 
-                spreads.append(s)
-                l.remove(l[0])
-                l.remove(i)
-                if l:
-                    i = 0
+        remaining[i] = q
+        if q:
+            by_quantity.setdefault(q, deque()).append(i)
+            by_sign[q > 0].append(i)
+    return pairs
+
+
+def get_spreads(legs):
+    """
+    Pair legs of the same type into vertical spreads
+
+    :param legs: list of Leg objects of one (Date, symbol) group, stock legs are not paired
+    """
+    spreads = []
+
+    for option_type in sorted(set(leg.option_type for leg in legs) - {STOCK}):
+        group = sorted((leg for leg in legs if leg.option_type == option_type), key=lambda leg: leg.strike)
+        pairs = pair_legs([leg.strike for leg in group], [leg.quantity for leg in group])
+        spreads.extend(Spread(group[i], group[j], n) for i, j, n in pairs)
     return spreads
+
+
+def name_positions(positions):
+    """
+    Set the strategy of Positions, looking across the groups of each symbol for calendars,
+    diagonals and covered positions
+
+    :param positions: all the Positions of the symbols to name, in (Date, symbol) order
+    """
+    symbols = {}
+    for position in positions:
+        symbols.setdefault(position.symbol, []).append(position)
+    for group in symbols.values():
+        names = classify_symbol([p.legs for p in group]) if len(group) > 1 else (None,)
+        for position, name in zip(group, names):
+            position.strategy = name or classify(position.legs)
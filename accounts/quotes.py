@@ -0,0 +1,181 @@
+import datetime
+import time
+
+from accounts.strategy import SHARES, STOCK
+from metrics import metrics
+from settings import *
+
+QUOTE_BATCH = 50  # symbols per quote request, with overrideSymbolCount
+
+
+def osi_key(symbol, date, call_put, strike):
+    """OSI symbol of an option contract, e.g. "SPY   261218C00450000" """
+    return "{:<6}{:%y%m%d}{}{:08d}".format(symbol, date, call_put[0], int(round(strike * 1000)))
+
+
+def quote_symbol(symbol, date, call_put, strike):
+    """Option symbol as the quote endpoint takes it, SYMBOL:YEAR:MONTH:DAY:CALLPUT:STRIKE"""
+    return "{}:{}:{:02d}:{:02d}:{}:{:g}".format(symbol, date.year, date.month, date.day, call_put, strike)
+
+
+def quote_key(quote):
+    """OSI symbol of an option QuoteData, the plain symbol for anything else"""
+    product = quote.get("Product", {})
+    if product.get("securityType") == "OPTN":
+        date = datetime.date(product["expiryYear"], product["expiryMonth"], product["expiryDay"])
+        return osi_key(product["symbol"], date, product["callPut"], product["strikePrice"])
+    return product.get("symbol")
+
+
+class QuoteCache:
+    def __init__(self, ttl=5.0):
+        """
+        Latest bid/ask per OSI symbol, considered stale after ttl seconds
+
+        :param ttl: seconds a quote is served before it is requested again
+        """
+        self.ttl = ttl
+        self.quotes = {}  # OSI symbol -> (time, bid, ask, last, previous close)
+
+    def get(self, key):
+        return self.quotes.get(key)
+
+    def stale(self, keys, now=None):
+        """Keys without a fresh quote, oldest first"""
+        now = time.monotonic() if now is None else now
+        stale = [(self.quotes[k][0] if k in self.quotes else 0.0, k) for k in keys
+                 if k not in self.quotes or now - self.quotes[k][0] >= self.ttl]
+        return [k for _, k in sorted(stale)]
+
+    def update(self, quotes, now=None):
+        """Store QuoteData entries from the quote endpoint"""
+        now = time.monotonic() if now is None else now
+        for quote in quotes:
+            detail = quote.get("All") or quote.get("Intraday") or {}
+            bid, ask = detail.get("bid", 0.0), detail.get("ask", 0.0)
+            last = detail.get("lastTrade", (bid + ask) / 2)
+            self.quotes[quote_key(quote)] = (now, bid, ask, last, detail.get("previousClose", last))
+
+
+class QuoteEngine:
+    def __init__(self, client, trackers, ttl=None, max_batches=None):
+        """
+        Polls quotes for the held contracts and recomputes leg gains from them
+
+        Gains move with every quote, so the fast refresh only needs this while the heavy
+        portfolio call can run much less often. Legs it has priced are marked quoted in their
+        LegStore, so portfolio refreshes do not put the older server values back.
+
+        :param client: AsyncClient used for the quote requests
+        :param trackers: list of PortfolioTracker whose legs are quoted
+        :param ttl: seconds before a quote is requested again, [QUOTES] TTL in config.ini if None
+        :param max_batches: most batch requests per refresh, [QUOTES] MAX_BATCHES in config.ini if None
+        """
+        self.client = client
+        self.trackers = trackers
+        self.cache = QuoteCache(config.getfloat("QUOTES", "TTL", fallback=5.0) if ttl is None else ttl)
+        self.max_batches = config.getint("QUOTES", "MAX_BATCHES", fallback=10) if max_batches is None \
+            else max_batches
+        self.contracts = {}  # (symbol, date ordinal, type, strike) -> (OSI symbol, quote symbol)
+        self.risk = None  # RiskEngine, created on the first apply so NumPy loads off the startup path
+        self.priced = {}  # id(LegStore) -> row -> (positionId, quantity, spot) its greeks were computed at
+
+    def contract(self, leg):
+        store = leg.store
+        key = (leg.symbol, store.columns[4][leg.index], leg.option_type, leg.strike)
+        contract = self.contracts.get(key)
+        if contract is None and leg.option_type == STOCK:
+            contract = self.contracts[key] = (leg.symbol, leg.symbol)
+        elif contract is None:
+            date = store.date(key[1])
+            contract = self.contracts[key] = (osi_key(leg.symbol, date, leg.option_type, leg.strike),
+                                              quote_symbol(leg.symbol, date, leg.option_type, leg.strike))
+        return contract
+
+    async def refresh(self):
+        """
+        Request stale quotes in full batches and apply them to the legs
+
+        :return: set of (date ordinal, symbol) group keys whose positions changed
+        """
+        symbols = {}  # OSI symbol or underlying -> symbol to request
+        for tracker in self.trackers:
+            for leg in tracker.legs.values():
+                osi, symbol = self.contract(leg)
+                symbols[osi] = symbol
+                symbols[leg.symbol] = leg.symbol
+
+        stale = self.cache.stale(symbols)[:QUOTE_BATCH * self.max_batches]
+        metrics.count("quotes requested", len(stale))
+        if stale:
+            self.cache.update(await self.client.get_quotes([symbols[k] for k in stale]))
+        return self.apply()
+
+    def apply(self):
+        """
+        Recompute day and total gains of every leg from the cached bid/ask, then the greeks of
+        the legs whose option or underlying quote moved
+        """
+        if self.risk is None:
+            from accounts.greeks import RiskEngine
+            self.risk = RiskEngine()
+
+        with metrics.timer("marks"):
+            return self._apply()
+
+    def _apply(self):
+        changed = set()
+        for tracker in self.trackers:
+            with tracker.store.lock:
+                changed |= self._apply_tracker(tracker)
+        return changed
+
+    def _apply_tracker(self, tracker):
+        """Reprice the legs of one tracker, with its LegStore locked"""
+        changed = set()
+        store = tracker.store
+        priced = self.priced.setdefault(id(store), {})
+        spots = {}
+        rows = []
+        for leg in tracker.legs.values():
+            quote = self.cache.get(self.contract(leg)[0])
+            if quote is None:
+                continue
+            _, bid, ask, _, previous_close = quote
+            mark = (bid + ask) / 2
+            paid = leg.price_paid
+            quantity = leg.quantity
+            stock = leg.option_type == STOCK
+            size = quantity if stock else quantity * SHARES
+            sign = 1 if quantity > 0 else -1
+            values = {
+                7: (mark - previous_close) * size,
+                8: (mark - previous_close) / previous_close * 100 * sign if previous_close else 0.0,
+                9: (mark - paid) * size,
+                10: (mark - paid) / paid * 100 * sign if paid else 0.0,
+                11: bid,
+                12: ask,
+            }
+            if stock:
+                # A share moves one for one with itself and has no other greeks
+                values.update({14: float(quantity), 15: 0.0, 16: 0.0, 17: 0.0})
+            moved = store.set(leg.index, values)
+            store.quoted.add(leg.index)
+            if moved:
+                changed.add(tracker.key(leg))
+            if stock:
+                continue
+
+            underlying = self.cache.get(leg.symbol)
+            if underlying is None:
+                continue
+            spot = spots[leg.symbol] = underlying[3]
+            state = (leg.id, quantity, spot)
+            if moved or priced.get(leg.index) != state:
+                priced[leg.index] = state
+                rows.append(leg.index)
+                changed.add(tracker.key(leg))
+
+        with metrics.timer("risk"):
+            self.risk.update(store, rows, spots)
+        return changed
@@ -0,0 +1,179 @@
+import bisect
+import os
+import random
+import tarfile
+import threading
+import time
+import zipfile
+
+from accounts.account import find_account, get_accounts, get_balance_data, get_positions, get_quote_data
+from accounts.capture import loads
+from accounts.quotes import QuoteEngine
+from accounts.tracker import PortfolioTracker
+from settings import *
+
+
+class Recording:
+    def __init__(self, path):
+        """
+        Captured responses from a directory or a .zip / .tar.gz archive
+
+        Files are named <time ms>-<endpoint>.json as written by ResponseCapture, or just
+        <endpoint>.json for a single set of fixtures. Portfolio pages after the first belong
+        to the portfolio response recorded before them.
+
+        :param path: directory or archive
+        """
+        self.path = path
+        self.lock = threading.Lock()
+
+        if os.path.isdir(path):
+            self.archive = None
+            names = os.listdir(path)
+        elif zipfile.is_zipfile(path):
+            self.archive = zipfile.ZipFile(path)
+            names = self.archive.namelist()
+        else:
+            self.archive = tarfile.open(path)
+            names = [m.name for m in self.archive.getmembers() if m.isfile()]
+
+        self.frames = {}  # endpoint -> list of (time ms, [file names])
+        for name in sorted(names, key=lambda n: os.path.basename(n)):
+            stem, ext = os.path.splitext(os.path.basename(name))
+            if ext != ".json":
+                continue
+            t, _, endpoint = stem.partition("-") if stem.split("-")[0].isdigit() else ("0", "", stem)
+            endpoint, _, page = endpoint.partition("-")
+            frames = self.frames.setdefault(endpoint, [])
+            if page and frames:
+                frames[-1][1].append(name)
+            elif not page:
+                frames.append((int(t), [name]))
+
+        times = [frames[0][0] for frames in self.frames.values() if frames]
+        self.start = min(times) if times else 0
+        self.times = {endpoint: [t for t, _ in frames] for endpoint, frames in self.frames.items()}
+
+    def read(self, name):
+        with self.lock:
+            if self.archive is None:
+                with open(os.path.join(self.path, name), "rb") as f:
+                    return f.read()
+            if isinstance(self.archive, zipfile.ZipFile):
+                return self.archive.read(name)
+            return self.archive.extractfile(name).read()
+
+    def load(self, endpoint, n):
+        """Parsed bodies (all pages) of the n-th recorded response of an endpoint"""
+        return [loads(self.read(name)) for name in self.frames[endpoint][n][1]]
+
+    def find(self, endpoint, t):
+        """Index of the last response of an endpoint recorded at or before time t ms, -1 if none"""
+        return bisect.bisect_right(self.times.get(endpoint, []), t) - 1
+
+    def count(self, endpoint):
+        return len(self.frames.get(endpoint, []))
+
+
+class ReplayAccount:
+    def __init__(self, path, account_id=None, speed=1.0, jitter=0.0):
+        """
+        Serves recorded responses behind the same interface as Account
+
+        :param path: directory or archive of captured responses, see Recording
+        :param account_id: account to pick from the recorded account list, the first one if None
+        :param speed: playback speed relative to the recording, 0 steps one response per call
+        :param jitter: maximum random delay in seconds added to every call, to mimic the network
+        """
+        self.recording = Recording(path)
+        self.account_id = account_id
+        self.speed = speed
+        self.jitter = jitter
+        self.tracker = PortfolioTracker()
+        self.quotes = QuoteEngine(self, [self.tracker])
+        self.started = None
+        self.steps = {}  # endpoint -> next response index when stepping
+        self.finished = False  # played past the last recorded portfolio
+        self.times = {}  # endpoint -> recorded time ms of the last response served
+        self.recorded = {}  # product key -> latest recorded QuoteData
+        self.quote_frame = -1
+        self.account = self.get_account()
+
+    def close(self):
+        if self.recording.archive is not None:
+            self.recording.archive.close()
+
+    def frame(self, endpoint):
+        """Index of the response of an endpoint due now"""
+        if self.jitter:
+            time.sleep(random.uniform(0, self.jitter))
+
+        count = self.recording.count(endpoint)
+        if self.speed <= 0:
+            n = self.steps.get(endpoint, 0)
+            self.steps[endpoint] = n + 1
+            if endpoint == "portfolio" and n + 1 >= count:
+                self.finished = True
+            n = min(n, count - 1)
+            if n >= 0:
+                self.times[endpoint] = self.recording.times[endpoint][n]
+            return n
+
+        if self.started is None:
+            self.started = time.monotonic()
+        t = self.recording.start + (time.monotonic() - self.started) * self.speed * 1000
+        n = self.recording.find(endpoint, t)
+        if endpoint == "portfolio" and n >= count - 1:
+            self.finished = True
+        n = max(n, 0) if count else -1
+        if n >= 0:
+            self.times[endpoint] = self.recording.times[endpoint][n]
+        return n
+
+    def get_account(self):
+        """Account with account_id from the recorded account list"""
+        if not self.recording.count("list"):
+            return {"accountId": self.account_id, "accountIdKey": "", "institutionType": "BROKERAGE"}
+        data = self.recording.load("list", 0)[0]
+        if self.account_id is None:
+            return (get_accounts(data) or [None])[0]
+        return find_account(data, self.account_id)
+
+    def get_portfolio(self):
+        """Positions of the recorded portfolio response due now, None if nothing was recorded"""
+        n = self.frame("portfolio")
+        if n < 0:
+            return None
+        portfolio = []
+        for data in self.recording.load("portfolio", n):
+            portfolio.extend(get_positions(data) or [])
+        return self.tracker.update(portfolio)
+
+    def get_balance(self):
+        n = self.frame("balance")
+        if n >= 0:
+            return get_balance_data(self.recording.load("balance", n)[0])
+
+    def get_quotes(self, symbols=None):
+        """Latest recorded quote of every product up to now, symbols are ignored"""
+        n = self.frame("quote")
+        for i in range(self.quote_frame + 1, n + 1):
+            for quote in get_quote_data(self.recording.load("quote", i)[0]) or []:
+                product = quote.get("Product", {})
+                key = tuple(product.get(k) for k in ("symbol", "callPut", "strikePrice",
+                                                     "expiryYear", "expiryMonth", "expiryDay"))
+                self.recorded[key] = quote
+        self.quote_frame = max(self.quote_frame, n)
+        return list(self.recorded.values())
+
+    def get_marks(self):
+        """
+        Reprice the legs from the recorded quotes due now, as AsyncClient.get_marks does from live ones
+
+        The recording holds whatever quotes were captured, so every one of them goes to the
+        QuoteEngine's cache instead of only the stale contracts.
+
+        :return: set of group keys whose positions changed
+        """
+        self.quotes.cache.update(self.get_quotes())
+        return self.quotes.apply()
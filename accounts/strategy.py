@@ -0,0 +1,176 @@
+"""
+Strategy names of (Date, symbol) groups, looked up by leg signature
+
+A signature is the shape of a group with the actual strikes and lot size taken out: the legs
+merged per contract, ordered by strike, each as (strike rank, type, quantity / gcd), plus whether
+the outer wings are the same width. Every pattern is indexed under the signature of its long
+version and its negation, so naming a group is one dict lookup.
+
+Calendars, diagonals and covered positions span several groups of a symbol (stock legs are a
+group of their own), classify_symbol names those.
+"""
+import math
+
+MAX_LEGS = 4  # larger groups are never looked up
+STOCK = "STOCK"  # option type of stock legs
+SHARES = 100  # shares per option contract
+STRATEGIES = {}  # signature -> name
+
+
+def signature(legs):
+    """
+    :param legs: iterable of (option type, strike, signed quantity)
+    :return: hashable shape of the legs, None if they cancel out
+    """
+    merged = {}
+    for option_type, strike, quantity in legs:
+        merged[strike, option_type] = merged.get((strike, option_type), 0) + quantity
+    merged = {k: q for k, q in merged.items() if q}
+    if not merged:
+        return None
+
+    strikes = sorted(set(strike for strike, _ in merged))
+    rank = {strike: n for n, strike in enumerate(strikes)}
+    lot = 0
+    for q in merged.values():
+        lot = math.gcd(lot, abs(q))
+
+    shape = tuple((rank[strike], option_type, q // lot) for (strike, option_type), q in sorted(merged.items()))
+    # Strikes like 1.1/1.2/1.3 do not have exactly equal float differences
+    wings = math.isclose(strikes[1] - strikes[0], strikes[-1] - strikes[-2], abs_tol=1e-6) \
+        if len(strikes) > 2 else None
+    return shape, wings
+
+
+def register(name, negated, legs, wings=None):
+    """
+    Add a pattern to the index
+
+    :param name: strategy name of the legs as given
+    :param negated: name of the same legs with every quantity flipped, None if it has none
+    :param legs: (strike rank, option type, quantity) of the long version
+    :param wings: True or False to require equal or unequal outer wings, either if None
+    """
+    for pattern, label in ((legs, name), ([(r, t, -q) for r, t, q in legs], negated)):
+        if label is None:
+            continue
+        shape = signature((t, r, q) for r, t, q in pattern)[0]
+        for w in ((True, False) if wings is None and len(set(r for r, _, _ in legs)) > 2 else (wings,)):
+            STRATEGIES[shape, w] = label
+
+
+# name, negated name, legs (strike rank, type, quantity), equal wings
+PATTERNS = (
+    ("Long Stock", "Short Stock", [(0, STOCK, 1)], None),
+    ("Long CALL", "Short CALL", [(0, "CALL", 1)], None),
+    ("Long PUT", "Short PUT", [(0, "PUT", 1)], None),
+    ("Long Straddle", "Short Straddle", [(0, "PUT", 1), (0, "CALL", 1)], None),
+    ("Long Strangle", "Short Strangle", [(0, "PUT", 1), (1, "CALL", 1)], None),
+    ("Long Guts", "Short Guts", [(0, "CALL", 1), (1, "PUT", 1)], None),
+    ("Synthetic Long", "Synthetic Short", [(0, "PUT", -1), (0, "CALL", 1)], None),
+    ("Bullish Risk Reversal", "Bearish Risk Reversal", [(0, "PUT", -1), (1, "CALL", 1)], None),
+    ("Bull Call Spread", "Bear Call Spread", [(0, "CALL", 1), (1, "CALL", -1)], None),
+    ("Bear Put Spread", "Bull Put Spread", [(0, "PUT", -1), (1, "PUT", 1)], None),
+    ("Call Ratio Spread", "Call Ratio Backspread", [(0, "CALL", 1), (1, "CALL", -2)], None),
+    ("Call Ratio Spread", "Call Ratio Backspread", [(0, "CALL", 2), (1, "CALL", -3)], None),
+    ("Put Ratio Spread", "Put Ratio Backspread", [(0, "PUT", -2), (1, "PUT", 1)], None),
+    ("Put Ratio Spread", "Put Ratio Backspread", [(0, "PUT", -3), (1, "PUT", 2)], None),
+    ("Long Call Butterfly", "Short Call Butterfly", [(0, "CALL", 1), (1, "CALL", -2), (2, "CALL", 1)], True),
+    ("Broken Wing Call Butterfly", "Short BW Call Butterfly",
+     [(0, "CALL", 1), (1, "CALL", -2), (2, "CALL", 1)], False),
+    ("Long Put Butterfly", "Short Put Butterfly", [(0, "PUT", 1), (1, "PUT", -2), (2, "PUT", 1)], True),
+    ("Broken Wing Put Butterfly", "Short BW Put Butterfly",
+     [(0, "PUT", 1), (1, "PUT", -2), (2, "PUT", 1)], False),
+    ("Short Iron Butterfly", "Long Iron Butterfly",
+     [(0, "PUT", 1), (1, "PUT", -1), (1, "CALL", -1), (2, "CALL", 1)], None),
+    ("Short Iron Condor", "Long Iron Condor",
+     [(0, "PUT", 1), (1, "PUT", -1), (2, "CALL", -1), (3, "CALL", 1)], None),
+    ("Long Call Condor", "Short Call Condor",
+     [(0, "CALL", 1), (1, "CALL", -1), (2, "CALL", -1), (3, "CALL", 1)], None),
+    ("Long Put Condor", "Short Put Condor", [(0, "PUT", 1), (1, "PUT", -1), (2, "PUT", -1), (3, "PUT", 1)], None),
+    ("Jade Lizard", None, [(0, "PUT", -1), (1, "CALL", -1), (2, "CALL", 1)], None),
+    ("Reverse Jade Lizard", None, [(0, "PUT", 1), (1, "PUT", -1), (2, "CALL", -1)], None),
+    ("Long Box", "Short Box", [(0, "PUT", -1), (0, "CALL", 1), (1, "PUT", 1), (1, "CALL", -1)], None),
+)
+
+for _pattern in PATTERNS:
+    register(*_pattern)
+
+
+def classify(legs):
+    """
+    Name the strategy of the legs of one (Date, symbol) group
+
+    :param legs: list of Leg objects
+    """
+    if len(legs) > MAX_LEGS * 2:
+        return "Complex Strategy"
+    key = signature((leg.option_type, leg.strike, leg.quantity) for leg in legs)
+    if key is None:
+        return "Flat"
+    if len(key[0]) > MAX_LEGS:
+        return "Complex Strategy"
+    return STRATEGIES.get(key, "Complex Strategy")
+
+
+def contracts(legs):
+    """Net quantity per (option type, strike) of the legs, without the ones that cancel out"""
+    merged = {}
+    for leg in legs:
+        merged[leg.option_type, leg.strike] = merged.get((leg.option_type, leg.strike), 0) + leg.quantity
+    return {k: q for k, q in merged.items() if q}
+
+
+def classify_symbol(groups):
+    """
+    Name the structures that span the (Date, symbol) groups of one symbol
+
+    Two expiries holding one contract each of the same type and size, on opposite sides, are a
+    calendar (same strike) or a diagonal, long when the later expiry is bought. Stock held with
+    only short calls, long puts or both, no more contracts than it covers, is a covered call, a
+    protective put or a collar; short stock with short puts is a covered put.
+
+    :param groups: Leg lists of the groups of the symbol in expiry order, stock legs last
+    :return: strategy name per group, None where the group is named on its own
+    """
+    names = [None] * len(groups)
+    shares = 0
+    options = []  # (group index, contracts)
+    for n, legs in enumerate(groups):
+        if legs and all(leg.option_type == STOCK for leg in legs):
+            shares += sum(leg.quantity for leg in legs)
+        else:
+            options.append((n, contracts(legs)))
+
+    if shares and options:
+        short_calls = long_calls = short_puts = long_puts = 0
+        for _, held in options:
+            for (option_type, _), q in held.items():
+                if option_type == "CALL":
+                    short_calls, long_calls = short_calls - min(q, 0), long_calls + max(q, 0)
+                else:
+                    short_puts, long_puts = short_puts - min(q, 0), long_puts + max(q, 0)
+        name = None
+        if shares > 0 and not long_calls and not short_puts and \
+                max(short_calls, long_puts) * SHARES <= shares:
+            if short_calls and long_puts:
+                name = "Collar"
+            elif short_calls:
+                name = "Covered Call"
+            elif long_puts:
+                name = "Protective Put"
+        elif shares < 0 and short_puts and not (short_calls or long_calls or long_puts) and \
+                short_puts * SHARES <= -shares:
+            name = "Covered Put"
+        return [name] * len(groups) if name else names
+
+    if len(options) == 2 and not shares:
+        (near, held1), (far, held2) = options
+        if len(held1) == 1 and len(held2) == 1:
+            ((type1, strike1), q1), = held1.items()
+            ((type2, strike2), q2), = held2.items()
+            if type1 == type2 and q1 == -q2:
+                kind = "Calendar" if math.isclose(strike1, strike2, abs_tol=1e-6) else "Diagonal"
+                names[near] = names[far] = "{} {} {}".format("Long" if q2 > 0 else "Short",
+                                                             type1.capitalize(), kind)
+    return names
@@ -0,0 +1,149 @@
+import bisect
+
+from accounts.builder import build_rows, extract_rows
+from accounts.portfolio import *
+from metrics import metrics
+
+STRUCTURE = (1, 2, 3, 4, 5)  # row fields that change pairing: symbol, type, strike, date, quantity
+
+
+class PortfolioTracker:
+    """
+    Keeps the Position list between portfolio refreshes and rebuilds only what changed
+
+    Legs are keyed by positionId and live in a LegStore. A leg whose prices moved is updated in
+    place, which only drops the cached aggregates of its position. Spread pairing and strategy
+    classification re-run only for the (Date, symbol) groups whose legs changed quantity, strike
+    or type, came or went; untouched Position objects, along with their expand state, are kept.
+    The first build, and any build from empty, is done at once by the columnar build_rows.
+    """
+
+    def __init__(self, store=None):
+        self.store = store if store is not None else LegStore()
+        self.legs = {}  # positionId -> Leg
+        self.members = {}  # (date ordinal, symbol) -> positionIds in response order
+        self.groups = {}  # (date ordinal, symbol) -> Position
+        self.keys = []  # sorted group keys, same order as portfolio
+        self.portfolio = []
+
+    def key(self, leg):
+        return self.store.columns[4][leg.index], leg.symbol
+
+    def update(self, positions):
+        """
+        Apply a fresh list of raw portfolio positions
+
+        :param positions: list of "Position" dicts from the PortfolioResponse
+        :return: list of Position objects ordered by (Date, symbol)
+        """
+        with metrics.timer("extract"):
+            rows = extract_rows(positions)
+        return self.update_rows(rows)
+
+    def update_rows(self, rows):
+        """Apply a fresh list of extract_rows() tuples, see update"""
+        with metrics.timer("tracker"), self.store.lock:
+            return self._update_rows(rows)
+
+    def _update_rows(self, rows):
+        if not self.legs:
+            return self._build_all(rows)
+
+        rebuild = set()  # groups to pair and classify again
+        seen = set()
+        store = self.store
+
+        for row in rows:
+            pid = row[0]
+            seen.add(pid)
+            key = (row[4], row[1])
+            leg = self.legs.get(pid)
+
+            if leg is None:
+                self.legs[pid] = store.add(row)
+                self.members.setdefault(key, []).append(pid)
+                rebuild.add(key)
+                continue
+
+            old = store.update(leg.index, row)
+            if old is None:
+                continue
+
+            old_key = (old[4], old[1])
+            if old_key != key:
+                self._discard(pid, old_key, rebuild)
+                self.members.setdefault(key, []).append(pid)
+                rebuild.add(key)
+            elif any(old[c] != store.columns[c][leg.index] for c in STRUCTURE):
+                rebuild.add(key)
+
+        if len(seen) != len(self.legs):
+            for pid in [pid for pid in self.legs if pid not in seen]:
+                leg = self.legs.pop(pid)
+                self._discard(pid, self.key(leg), rebuild)
+                store.remove(leg.index)
+
+        resort = False
+        with metrics.timer("rebuild"):
+            for key in rebuild:
+                if key in self.members:
+                    resort |= key not in self.groups
+                    self.groups[key] = self._build(key)
+                elif key in self.groups:
+                    del self.groups[key]
+                    resort = True
+        metrics.count("groups rebuilt", len(rebuild))
+
+        if resort:
+            self.keys = sorted(self.groups)
+            self.portfolio = [self.groups[key] for key in self.keys]
+        else:
+            self.portfolio = list(self.portfolio)
+            for key in rebuild:
+                self.portfolio[bisect.bisect_left(self.keys, key)] = self.groups[key]
+
+        # Strategies can span the expiries of a symbol, so every group of a touched symbol is renamed
+        symbols = set(key[1] for key in rebuild)
+        if symbols:
+            name_positions([p for p in self.portfolio if p.symbol in symbols])
+
+        return self.portfolio
+
+    def _build_all(self, rows):
+        """First build, or a rebuild from empty: all groups at once with the columnar builder"""
+        with metrics.timer("rebuild"):
+            portfolio = build_rows(rows, self.store)
+        self.members = {}
+        self.groups = {}
+        for position in portfolio:
+            key = (position.date.toordinal(), position.symbol)
+            self.groups[key] = position
+            self.members[key] = [leg.id for leg in position.legs]
+            for leg in position.legs:
+                self.legs[leg.id] = leg
+        self.keys = list(self.groups)
+        self.portfolio = portfolio
+        metrics.count("groups rebuilt", len(self.keys))
+        return self.portfolio
+
+    def _discard(self, pid, key, rebuild):
+        members = self.members[key]
+        members.remove(pid)
+        if not members:
+            del self.members[key]
+        rebuild.add(key)
+
+    def _build(self, key):
+        """Rebuild the Position of one group, carrying over the expand state of the old one"""
+        legs = [self.legs[pid] for pid in self.members[key]]
+        spreads = get_spreads(legs)
+
+        position = Position((self.store.date(key[0]), key[1]), spreads, legs)
+
+        old = self.groups.get(key)
+        if old is not None:
+            position.show_spreads = old.show_spreads
+            expanded = set((s.leg1.id, s.leg2.id) for s in old.spreads if s.show_legs)
+            for s in spreads:
+                s.show_legs = (s.leg1.id, s.leg2.id) in expanded
+        return position
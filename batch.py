@@ -0,0 +1,211 @@
+import csv
+import json
+import select
+import sys
+
+from metrics import metrics
+
+# Columns of an exported row. Every snapshot is written as position rows, each followed by its
+# spreads and legs; columns that do not apply to a row's kind are empty.
+FIELDS = ("time", "account", "kind", "symbol", "expiry", "strategy", "spread", "type", "strike", "quantity",
+          "price_paid", "days_gain", "days_gain_pct", "total_gain", "total_gain_pct", "bid", "ask",
+          "iv", "delta", "gamma", "theta", "vega")
+FORMATS = ("csv", "jsonl", "arrow")
+ARROW_BATCH = 4096  # rows per Arrow record batch
+
+
+def _number(value):
+    """None for values not known yet (NaN greeks of unquoted legs)"""
+    return None if value is None or value != value else value
+
+
+def _risk(risk, iv=None):
+    return (_number(iv),) + tuple(_number(v) for v in risk)
+
+
+def snapshot_rows(portfolio, time, account=None):
+    """
+    Rows of a portfolio in FIELDS order, generated one at a time
+
+    :param portfolio: list of Position, or AggregatePosition holding positions of several accounts
+    :param time: snapshot time in seconds since the epoch
+    :param account: account of plain Positions
+    """
+    for group in portfolio:
+        for owner, position in getattr(group, "positions", [(account, group)]):
+            expiry = position.date
+            yield (time, owner, "position", position.symbol, expiry, position.strategy, None, None, None, None,
+                   None, position.days_gain, position.days_gain_pct, position.total_gain,
+                   position.total_gain_pct, None, None) + _risk(position.risk())
+            for s in position.spreads:
+                spread = "{} {}/{}".format(s.direction, *s.strikes)
+                yield (time, owner, "spread", position.symbol, expiry, position.strategy, spread, s.option_type,
+                       None, s.quantity, s.price_paid, s.days_gain, s.days_gain_pct, s.total_gain,
+                       s.total_gain_pct, None, None) + _risk(s.risk())
+            for leg in position.legs:
+                yield (time, owner, "leg", position.symbol, expiry, position.strategy, None, leg.option_type,
+                       leg.strike, leg.quantity, leg.price_paid, leg.days_gain, leg.days_gain_pct,
+                       leg.total_gain, leg.total_gain_pct, _number(leg.bid), _number(leg.ask)) + \
+                      _risk(leg.risk(), leg.iv)
+
+
+class CsvWriter:
+    """One header line, then a line per row, write() returns the number of rows written"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.writer = csv.writer(stream)
+        self.writer.writerow(FIELDS)
+
+    def write(self, rows):
+        n = 0
+        for row in rows:
+            self.writer.writerow(row)
+            n += 1
+        self.stream.flush()
+        return n
+
+    def close(self):
+        self.stream.flush()
+
+
+class JsonLinesWriter:
+    """One JSON object per row, dates as YYYY-MM-DD"""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, rows):
+        n = 0
+        for row in rows:
+            self.stream.write(json.dumps(dict(zip(FIELDS, row)), default=str) + "\n")
+            n += 1
+        self.stream.flush()
+        return n
+
+    def close(self):
+        self.stream.flush()
+
+
+class ArrowWriter:
+    def __init__(self, stream, batch=ARROW_BATCH):
+        """
+        Arrow IPC stream of record batches of up to batch rows
+
+        Needs pyarrow, which is only imported here. Only one batch of rows is held at a time.
+
+        :param stream: binary file object
+        """
+        import pyarrow
+        self.pa = pyarrow
+        self.stream = stream
+        self.batch = batch
+        string, number = pyarrow.string(), pyarrow.float64()
+        types = {"time": pyarrow.timestamp("ms", tz="UTC"), "expiry": pyarrow.date32(),
+                 "quantity": pyarrow.int64()}
+        for name in ("account", "kind", "symbol", "strategy", "spread", "type"):
+            types[name] = string
+        self.schema = pyarrow.schema([(name, types.get(name, number)) for name in FIELDS])
+        self.writer = pyarrow.ipc.new_stream(stream, self.schema)
+
+    def write(self, rows):
+        n = 0
+        columns = [[] for _ in FIELDS]
+        for row in rows:
+            for column, value in zip(columns, row):
+                column.append(value)
+            n += 1
+            if len(columns[0]) == self.batch:
+                self.flush(columns)
+                columns = [[] for _ in FIELDS]
+        if columns[0]:
+            self.flush(columns)
+        self.stream.flush()
+        return n
+
+    def flush(self, columns):
+        columns[0] = [None if t is None else int(t * 1000) for t in columns[0]]
+        self.writer.write_batch(self.pa.record_batch(
+            [self.pa.array(c, type=f.type) for c, f in zip(columns, self.schema)], schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+        self.stream.flush()
+
+
+WRITERS = {"csv": CsvWriter, "jsonl": JsonLinesWriter, "arrow": ArrowWriter}
+
+
+def open_writer(format, stream):
+    """
+    Writer of a FORMATS format on a text stream, Arrow writes to its binary buffer
+
+    :raises ImportError: when the format needs pyarrow and it is not installed
+    """
+    if format == "arrow":
+        stream = getattr(stream, "buffer", stream)
+    return WRITERS[format](stream)
+
+
+def write_snapshot(writer, portfolio, time, account=None):
+    """
+    Stream the rows of one portfolio snapshot to a writer
+
+    :return: number of rows written
+    """
+    with metrics.timer("export"):
+        written = writer.write(snapshot_rows(portfolio, time, account))
+    metrics.count("rows exported", written)
+    return written
+
+
+def backfill(client, writer, count=None):
+    """
+    Export every recorded portfolio of a ReplayAccount as fast as it can be read
+
+    The client has to step through the recording (speed 0). Rows carry the recorded time.
+    Stops at the end of the recording or after count snapshots.
+
+    :return: number of snapshots written
+    """
+    account = getattr(client, "account_id", None)
+    snapshots = 0
+    while not client.finished and (count is None or snapshots < count):
+        portfolio = client.get_portfolio()
+        if portfolio is None:
+            break
+        write_snapshot(writer, portfolio, client.times.get("portfolio", 0) / 1000, account)
+        snapshots += 1
+    return snapshots
+
+
+def follow(worker, writer, count=None, expired=None):
+    """
+    Export the portfolio every time the RefreshWorker publishes a new one or re-prices it
+
+    Stops after count snapshots, when a replay at recorded speed runs out, when expired()
+    reports that the access token expired (there is no one to sign in again), or on Ctrl-C.
+
+    :return: number of snapshots written
+    """
+    account = getattr(worker.client, "account_id", None)
+    snapshots = 0
+    last = worker.snapshot.portfolio  # nothing is written before the first portfolio fetch
+    try:
+        while count is None or snapshots < count:
+            select.select([worker.read_fd], [], [], 1.0)
+            if expired is not None and expired():
+                sys.stderr.write("Access token expired, stopping the export\n")
+                break
+            snapshot = worker.drain()
+            changed = worker.take_changed()
+            if snapshot.portfolio is last and not changed:
+                continue
+            last = snapshot.portfolio
+            write_snapshot(writer, snapshot.portfolio, snapshot.time, account)
+            snapshots += 1
+            if getattr(worker.client, "finished", False):
+                break
+    except KeyboardInterrupt:
+        pass
+    return snapshots
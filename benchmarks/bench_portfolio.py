@@ -0,0 +1,62 @@
+"""
+Time Account.get_portfolio model building, incremental refresh and spread pairing on synthetic books
+
+Run from the repository root: python -m benchmarks.bench_portfolio
+"""
+import copy
+import random
+import sys
+import time
+
+from accounts.builder import build_portfolio
+from accounts.portfolio import pair_legs
+from accounts.tracker import PortfolioTracker
+from benchmarks.synthetic import make_positions
+
+SIZES = (10, 100, 1000, 10000)
+
+
+def bench(func, *args, repeat=5):
+    """Best of repeat wall times in seconds"""
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - t)
+    return best
+
+
+def main(sizes=SIZES):
+    print("{:>8}{:>12}{:>14}{:>12}{:>16}".format("legs", "positions", "build ms", "us/leg", "refresh 1% ms"))
+    for n in sizes:
+        positions = make_positions(n)
+        portfolio = build_portfolio(positions)
+        t = bench(lambda p: PortfolioTracker().update(p), positions)
+
+        # Refresh where 1% of the legs moved
+        tracker = PortfolioTracker()
+        tracker.update(positions)
+        refreshes = []
+        for r in range(5):
+            moved = copy.deepcopy(positions)
+            for p in random.Random(r).sample(moved, max(1, n // 100)):
+                p["daysGain"] += 1
+            refreshes.append(moved)
+        t_refresh = min(bench(tracker.update, moved, repeat=1) for moved in refreshes)
+
+        print("{:>8}{:>12}{:>14.2f}{:>12.2f}{:>16.2f}".format(n, len(portfolio), t * 1e3, t * 1e6 / n,
+                                                              t_refresh * 1e3))
+
+    # One expiry with many strikes: alternating long/short legs of mixed size
+    print()
+    print("{:>8}{:>12}{:>14}{:>12}".format("strikes", "spreads", "pair ms", "us/leg"))
+    rnd = random.Random(0)
+    for n in sizes:
+        strikes = list(range(n))
+        quantities = [rnd.choice((1, 2, 5, 10)) * (1 if i % 2 else -1) for i in strikes]
+        t = bench(pair_legs, strikes, quantities)
+        print("{:>8}{:>12}{:>14.2f}{:>12.2f}".format(n, len(pair_legs(strikes, quantities)), t * 1e3, t * 1e6 / n))
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or SIZES)
@@ -0,0 +1,158 @@
+"""
+Time each stage of the refresh and render pipeline on synthetic books
+
+Run from the repository root:
+
+    python -m benchmarks.run --sizes 10 1000 50000 --output results.jsonl
+    python -m benchmarks.run --baseline results.jsonl
+
+Every measurement is written as one JSON line. With --baseline, stages slower than the
+baseline by more than --threshold are reported as regressions and the exit status is 1.
+"""
+import argparse
+import copy
+import curses
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+from accounts.account import get_positions
+from accounts.builder import build_portfolio, extract_rows
+from accounts.capture import loads, orjson
+from accounts.portfolio import get_spreads
+from accounts.strategy import classify
+from accounts.tracker import PortfolioTracker
+from benchmarks.synthetic import make_portfolio_response, make_positions
+from terminal.headless import HeadlessScreen
+from terminal.terminal import Term
+
+SIZES = (10, 100, 1000, 10000, 50000)
+
+
+def timings(func, repeat):
+    """Wall times in seconds of repeat calls"""
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t)
+    return times
+
+
+def version():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def stages(n, repeat):
+    """Yield (stage, times, extra) for a synthetic book of n legs"""
+    positions = make_positions(n)
+    body = json.dumps(make_portfolio_response(positions)).encode()
+    yield "parse", timings(lambda: get_positions(loads(body)), repeat), {"bytes": len(body)}
+    yield "extract", timings(lambda: extract_rows(positions), repeat), {}
+    # First fetch as the app runs it: a fresh tracker builds every group with the columnar builder
+    yield "build", timings(lambda: PortfolioTracker().update(positions), repeat), {}
+
+    portfolio = build_portfolio(positions)
+    yield "pairing", timings(lambda: [get_spreads(p.legs) for p in portfolio], repeat), {}
+    yield "classify", timings(lambda: [classify(p.legs) for p in portfolio], repeat), {}
+
+    # Incremental refresh where 1% of the legs moved
+    tracker = PortfolioTracker()
+    tracker.update(positions)
+    refreshes = []
+    for r in range(repeat):
+        moved = copy.deepcopy(positions)
+        for p in random.Random(r).sample(moved, max(1, n // 100)):
+            p["daysGain"] += 1
+        refreshes.append(moved)
+    yield "refresh", [timings(lambda: tracker.update(moved), 1)[0] for moved in refreshes], {}
+
+    # Fully expanded view
+    for p in portfolio:
+        p.show_spreads = True
+        for s in p.spreads:
+            s.show_legs = True
+    term = Term(HeadlessScreen())
+    yield "stream", timings(lambda: term.get_portfolio_stream(portfolio), repeat), {}
+    yield "index", timings(lambda: term.get_portfolio_index(portfolio), repeat), {"rows": len(term.index)}
+
+    def first_frame():
+        term.portfolio = None
+        term.redraw()
+        term.show_portfolio(portfolio)
+
+    def scroll_frame():
+        term.handle_key(curses.KEY_DOWN)
+        term.show_portfolio(portfolio)
+
+    yield "render first", timings(first_frame, repeat), {}
+    yield "render scroll", timings(scroll_frame, repeat * 10), {}
+    yield "render idle", timings(lambda: term.show_portfolio(portfolio), repeat * 10), {}
+
+    def sort_frame():
+        term.handle_key(ord('s'))
+        term.show_portfolio(portfolio)
+
+    yield "sort switch", timings(sort_frame, repeat * 2), {}
+
+
+def run(sizes, repeat):
+    meta = {"version": version(), "python": platform.python_version(), "json": "orjson" if orjson else "json",
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    for n in sizes:
+        for stage, times, extra in stages(n, repeat):
+            result = dict(meta, stage=stage, legs=n, repeat=len(times), best_ms=min(times) * 1e3,
+                          median_ms=statistics.median(times) * 1e3, **extra)
+            yield result
+
+
+def load(path):
+    with open(path) as f:
+        return {(r["stage"], r["legs"]): r for r in map(json.loads, f) if r}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="book sizes in legs")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="JSON lines file to write results to")
+    parser.add_argument("--baseline", help="JSON lines results to compare against")
+    parser.add_argument("--threshold", type=float, default=1.25, help="slowdown ratio reported as regression")
+    args = parser.parse_args()
+
+    baseline = load(args.baseline) if args.baseline else {}
+    output = open(args.output, "w") if args.output else None
+    regressions = 0
+
+    print("{:<16}{:>8}{:>12}{:>12}{:>10}".format("stage", "legs", "best ms", "median ms", "vs base"))
+    for result in run(args.sizes, args.repeat):
+        if output is not None:
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+
+        ratio = ""
+        base = baseline.get((result["stage"], result["legs"]))
+        if base is not None and base["best_ms"] > 0:
+            r = result["best_ms"] / base["best_ms"]
+            ratio = "{:.2f}x{}".format(r, " !" if r > args.threshold else "")
+            regressions += r > args.threshold
+        print("{:<16}{:>8}{:>12.3f}{:>12.3f}{:>10}".format(result["stage"], result["legs"], result["best_ms"],
+                                                          result["median_ms"], ratio))
+
+    if output is not None:
+        output.close()
+    if regressions:
+        print("{} stage(s) slower than baseline".format(regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
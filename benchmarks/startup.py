@@ -0,0 +1,61 @@
+"""
+Report where the startup imports spend their time
+
+Run from the repository root:
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --module accounts.client --top 30
+
+Each module is imported in a fresh interpreter with -X importtime, so nothing is cached. The
+report lists the slowest imports by cumulative time, and the total wall time of the import.
+"""
+import argparse
+import subprocess
+import sys
+import time
+
+# What main.py imports before the first frame, and what it imports later on demand
+MODULES = ("main", "accounts.replay", "accounts.auth", "accounts.client", "accounts.greeks")
+
+
+def import_times(module):
+    """
+    Import a module in a fresh interpreter
+
+    :return: (wall seconds, list of (self us, cumulative us, module name) in import order)
+    """
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module],
+                            capture_output=True, text=True, check=True)
+    wall = time.perf_counter() - start
+
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        times.append((int(own), int(cumulative), name.rstrip()))
+    return wall, times
+
+
+def report(module, top=15):
+    wall, times = import_times(module)
+    print("{}: {:.0f} ms wall, {} modules".format(module, wall * 1e3, len(times)))
+    print("{:>10} {:>10}  {}".format("self ms", "total ms", "module"))
+    for own, cumulative, name in sorted(times, key=lambda t: -t[1])[:top]:
+        print("{:>10.1f} {:>10.1f}  {}".format(own / 1e3, cumulative / 1e3, name))
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--module", action="append", help="module to import, repeatable, all of MODULES if omitted")
+    parser.add_argument("--top", type=int, default=15, help="slowest imports to list per module")
+    args = parser.parse_args()
+
+    for module in args.module or MODULES:
+        report(module, args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Synthetic PortfolioResponse payloads for benchmarks"""
+import random
+
+SYMBOLS = ["SPY", "QQQ", "IWM", "AAPL", "MSFT", "AMZN", "TSLA", "NVDA", "META", "GOOGL", "AMD", "NFLX"]
+
+
+def make_leg(position_id, symbol, date, call_put, strike, quantity, rnd):
+    price_paid = round(rnd.uniform(0.05, 15), 2)
+    mark = max(round(price_paid + rnd.uniform(-2, 2), 2), 0.01)
+    total_gain = round((mark - price_paid) * quantity * 100, 2)
+    days_gain = round(rnd.uniform(-0.5, 0.5) * quantity * 100, 2)
+    return {
+        "positionId": position_id,
+        "osiKey": "%s-%02d%02d%02d%s%08d" % (symbol, date[0] % 100, date[1], date[2], call_put[0],
+                                               int(strike * 1000)),
+        "quantity": quantity,
+        "pricePaid": price_paid,
+        "daysGain": days_gain,
+        "daysGainPct": round(rnd.uniform(-50, 50), 2),
+        "totalGain": total_gain,
+        "totalGainPct": round(total_gain / max(abs(price_paid * quantity * 100), 1) * 100, 2),
+        "Product": {
+            "symbol": symbol,
+            "securityType": "OPTN",
+            "callPut": call_put,
+            "expiryYear": date[0],
+            "expiryMonth": date[1],
+            "expiryDay": date[2],
+            "strikePrice": strike,
+        },
+        "Complete": {"bid": round(mark - 0.05, 2), "ask": round(mark + 0.05, 2), "lastTrade": mark,
+                     "previousClose": round(mark + rnd.uniform(-0.5, 0.5), 2)},
+    }
+
+
+def make_positions(n_legs, n_symbols=None, n_expiries=8, seed=0):
+    """
+    Generate about n_legs option legs laid out as singles, verticals, strangles and iron condors
+
+    :param n_legs: number of legs to generate
+    :param n_symbols: number of underlyings, scaled with the book size if None
+    :param n_expiries: number of expiries per underlying
+    """
+    rnd = random.Random(seed)
+    if n_symbols is None:
+        n_symbols = max(1, min(len(SYMBOLS) * 50, n_legs // 20))
+    symbols = [SYMBOLS[i % len(SYMBOLS)] + ("" if i < len(SYMBOLS) else str(i // len(SYMBOLS)))
+               for i in range(n_symbols)]
+    expiries = [(2026 + m // 12, m % 12 + 1, rnd.choice((15, 16, 17, 18, 19, 20))) for m in range(n_expiries)]
+
+    positions = []
+    next_id = 1
+
+    while len(positions) < n_legs:
+        symbol = rnd.choice(symbols)
+        date = rnd.choice(expiries)
+        base = rnd.randrange(20, 500)
+        width = rnd.choice((1, 2, 5, 10))
+        q = rnd.choice((1, 2, 3, 5, 10))
+        kind = rnd.random()
+
+        if kind < 0.25:
+            legs = [(rnd.choice(("CALL", "PUT")), base, rnd.choice((q, -q)))]
+        elif kind < 0.6:
+            call_put = rnd.choice(("CALL", "PUT"))
+            legs = [(call_put, base, q), (call_put, base + width, -q)]
+        elif kind < 0.75:
+            legs = [("PUT", base, -q), ("CALL", base + width, -q)]
+        else:
+            legs = [("PUT", base - 2 * width, q), ("PUT", base - width, -q),
+                    ("CALL", base + width, -q), ("CALL", base + 2 * width, q)]
+
+        for call_put, strike, quantity in legs:
+            positions.append(make_leg(next_id, symbol, date, call_put, float(strike), quantity, rnd))
+            next_id += 1
+    return positions[:n_legs]
+
+
+def make_portfolio_response(positions, account_id="12345678"):
+    """Wrap positions the way the portfolio endpoint returns them"""
+    return {
+        "PortfolioResponse": {
+            "AccountPortfolio": [{"accountId": account_id, "totalPages": 1, "Position": positions}]
+        }
+    }
@@ -1,60 +1,193 @@
 """This Python script provides examples on using the E*TRADE API endpoints"""
 from __future__ import print_function
 
-import time
-import webbrowser
+import argparse
+import sys
 
-from rauth import OAuth1Service
-
-from accounts.account import Account
+from metrics import Exporter, SamplingProfiler, metrics
+from refresh import RefreshWorker
 from settings import *
+from settings import load_config, setup_logging
 from terminal.terminal import Term
 
+EXPIRED_MESSAGE = "Access token expired: a to sign in again, q to quit"
+
 
-def oauth():
-    """Allows user authorization for the sample application with OAuth 1"""
-    etrade = OAuth1Service(
-        name="etrade",
-        consumer_key=config["DEFAULT"]["CONSUMER_KEY"],
-        consumer_secret=config["DEFAULT"]["CONSUMER_SECRET"],
-        request_token_url="https://api.etrade.com/oauth/request_token",
-        access_token_url="https://api.etrade.com/oauth/access_token",
-        authorize_url="https://us.etrade.com/e/t/etws/authorize?key={}&token={}",
-        base_url="https://api.etrade.com")
+def oauth(tokens):
+    """
+    Allows user authorization for the sample application with OAuth 1
 
+    :param tokens: TokenManager, reusing the stored access token when it is still good
+    """
     base_url = config["DEFAULT"]["PROD_BASE_URL"]
     account_id = config["DEFAULT"]["ACCOUNT_NUMBER"]
-
-    request_token, request_token_secret = etrade.get_request_token(params={"oauth_callback": "oob", "format": "json"})
-    authorize_url = etrade.authorize_url.format(etrade.consumer_key, request_token)
-
-    webbrowser.open(authorize_url)
-
-    text_code = input("Please accept agreement and enter text code from browser: ")
-    session = etrade.get_auth_session(request_token, request_token_secret, params={"oauth_verifier": text_code})
-    return session, base_url, account_id
-
-
-def main():
-    s, u, a = oauth()
-    account = Account(s, u, a)
-
-    portfolio_data = account.get_portfolio()
-    # balance_data = account.get_balance()
-    with Term() as term:
-        c = term.stdscr.getch()
-
-        t1 = time.perf_counter()
-        while True:
-            t2 = time.perf_counter()
-            if t2 > t1 + 1:
-                t1 = t2
-                portfolio_data = account.get_portfolio()
-
-            term.show_portfolio(portfolio_data)
-
-            if c == ord('q'):
-                break
+    return tokens.get_session(), base_url, account_id
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description="TUI Widget-App for E*Trade")
+    parser.add_argument("--all-accounts", action="store_true",
+                        help="show every open account, grouped by underlying and expiry")
+    parser.add_argument("--replay", metavar="PATH",
+                        help="play recorded responses from a capture directory or archive instead of the API")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="replay speed relative to the recording, 0 for one response per refresh")
+    parser.add_argument("--jitter", type=float, default=0.0,
+                        help="maximum random delay in seconds added to every replayed call")
+    parser.add_argument("--metrics", metavar="PATH",
+                        help="export stage timings and counters to PATH, [METRICS] EXPORT in config.ini by default")
+    parser.add_argument("--metrics-format", choices=("prometheus", "jsonl"),
+                        help="prometheus text rewritten every interval, or one JSON line appended per interval")
+    parser.add_argument("--profile", metavar="PATH",
+                        help="sample the stacks of all threads and write them to PATH as collapsed stacks")
+    parser.add_argument("--export", choices=("csv", "jsonl", "arrow"),
+                        help="run without the UI and stream every refresh as rows in this format, see export()")
+    parser.add_argument("--output", metavar="PATH", help="file to export to, stdout if omitted")
+    parser.add_argument("--count", type=int, help="stop exporting after this many snapshots")
+    return parser.parse_args(args)
+
+
+def prompt_stderr(message):
+    """input() asking on stderr, for exports whose rows go to stdout"""
+    sys.stderr.write(message)
+    sys.stderr.flush()
+    return sys.stdin.readline().rstrip("\n")
+
+
+def get_client(args, prompt=None):
+    """
+    Client of the command line options
+
+    :param prompt: asks for the OAuth verification code, input() if None
+
+    :return: (client, TokenManager to stop on exit or None)
+    """
+    # Clients are imported where they are used, replay runs without the HTTP and OAuth libraries
+    if args.replay:
+        from accounts.replay import ReplayAccount
+        client = ReplayAccount(args.replay, config.get("DEFAULT", "ACCOUNT_NUMBER", fallback=None),
+                               args.speed, args.jitter)
+        return client, None
+
+    from accounts.auth import TokenManager
+    from accounts.client import AsyncClient, OAuth1Signer
+    from accounts.multi import MultiAccount
+    tokens = TokenManager.from_config(prompt or input)
+    s, u, a = oauth(tokens)
+    tokens.start()
+    if args.all_accounts:
+        return MultiAccount(OAuth1Signer.from_session(s), u), tokens
+    return AsyncClient(OAuth1Signer.from_session(s), u, a), tokens
+
+
+def sign_in(tokens, client, worker, term):
+    """
+    Authorize again after the access token expired and poll right away with the new token
+
+    The prompt for the text code runs on the plain terminal, the UI comes back afterwards.
+    """
+    with term.suspended():
+        print("The access token expired, sign in again in the browser.", file=sys.stderr)
+        try:
+            session = tokens.authorize()
+        except Exception as e:
+            logger.error("Signing in failed: %s", e)
+            return
+    client.signer.update(session)
+    worker.retry()
+
+
+def export(args):
+    """
+    Headless counterpart of main(): the same refresh pipeline, every snapshot written as rows
+
+    A replay with --speed 0 is exported as fast as it can be read, each snapshot stamped with
+    its recorded time. Otherwise every refresh of the RefreshWorker is written until --count
+    snapshots, the end of the replay, or Ctrl-C. Signing in happens before anything is written
+    and asks on stderr, so a prompt never ends up among the rows.
+    """
+    from batch import backfill, follow, open_writer
+
+    if args.export == "arrow":
+        # Checked before --output is created, so a missing pyarrow does not leave an empty file
+        try:
+            import pyarrow
+        except ImportError:
+            sys.exit("Arrow export needs pyarrow")
+
+    client, tokens = get_client(args, prompt_stderr)
+    stream = writer = None
+    try:
+        stream = sys.stdout
+        if args.output:
+            stream = open(args.output, "wb") if args.export == "arrow" else open(args.output, "w", newline="")
+        writer = open_writer(args.export, stream)
+        if args.replay and args.speed <= 0:
+            backfill(client, writer, args.count)
+            client.close()
+        else:
+            with RefreshWorker(client) as worker:
+                follow(worker, writer, args.count, tokens.expired if tokens is not None else None)
+    finally:
+        if writer is not None:
+            writer.close()
+        if stream is not None and stream is not sys.stdout:
+            stream.close()
+        if tokens is not None:
+            tokens.stop()
+
+
+def main(args=None):
+    args = parse_args(args)
+    load_config()
+    setup_logging()
+    metrics.enabled = config.getboolean("METRICS", "ENABLED", fallback=True)
+
+    if args.export:
+        return export(args)
+
+    client, tokens = get_client(args)
+
+    history = None
+    if not args.replay:
+        from accounts.history import SnapshotStore
+        history = SnapshotStore.from_config()
+
+    exporter = Exporter.from_config(metrics, args.metrics, args.metrics_format)
+    profiler = SamplingProfiler(args.profile) if args.profile else None
+    for background in (exporter, profiler):
+        if background is not None:
+            background.start()
+    try:
+        with RefreshWorker(client, history=history) as worker, Term() as term:
+            snapshot = worker.snapshot
+            changed = None
+            while True:
+                expired = tokens is not None and tokens.expired()
+                term.status = snapshot.status
+                if expired:
+                    term.status = [EXPIRED_MESSAGE] + list(snapshot.status)
+                term.show_portfolio(snapshot.portfolio, changed)
+                changed = None
+
+                # Sleep until a key is pressed or the worker published a new snapshot
+                if term.wait([worker.read_fd], timeout=1):
+                    snapshot = worker.drain()
+                    changed = worker.take_changed()
+
+                for c in term.keys():
+                    if c == ord('q') and not term.searching:
+                        return
+                    if c == ord('a') and expired and not term.searching:
+                        sign_in(tokens, client, worker, term)
+                        continue
+                    term.handle_key(c)
+    finally:
+        if tokens is not None:
+            tokens.stop()
+        for background in (exporter, profiler):
+            if background is not None:
+                background.stop()
 
     # market = Market(session, base_url)
     # market.quotes()
@@ -0,0 +1,244 @@
+import bisect
+import collections
+import json
+import os
+import sys
+import threading
+import time
+
+from settings import *
+
+# Upper bounds in seconds of the histogram buckets, 10 us to ~100 s growing by 25%
+BUCKETS = tuple(1e-5 * 1.25 ** n for n in range(73))
+PROFILE_INTERVAL = 0.005  # seconds between profiler samples
+
+
+class Histogram:
+    """Counts of observations in fixed log-scale buckets, for percentiles without keeping samples"""
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def percentile(self, q):
+        """Upper bound of the bucket holding the q-th percentile, 0 if there are no observations"""
+        if not self.count:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return BUCKETS[min(i, len(BUCKETS) - 1)]
+        return BUCKETS[-1]
+
+
+class Timer:
+    """Context manager adding the time spent in its block to a histogram"""
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        pass
+
+
+NULL_TIMER = _NullTimer()
+
+
+class Metrics:
+    def __init__(self, enabled=True):
+        """
+        Stage timings and counters of the refresh and render pipeline
+
+        Timings go to histograms by name: pipeline stages ("tracker", "render", ...), whole
+        endpoint refreshes ("fetch portfolio") and single HTTP requests ("http portfolio").
+        Counters count events and bytes. When disabled, timer() returns a shared no-op.
+        """
+        self.enabled = enabled
+        self.histograms = collections.defaultdict(Histogram)
+        self.counters = collections.defaultdict(int)
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+    def timer(self, name):
+        return Timer(self, name) if self.enabled else NULL_TIMER
+
+    def observe(self, name, seconds):
+        if self.enabled:
+            with self.lock:
+                self.histograms[name].observe(seconds)
+
+    def count(self, name, n=1):
+        if self.enabled:
+            with self.lock:
+                self.counters[name] += n
+
+    def summary(self, names=None):
+        """
+        :param names: histograms to include, all if None
+        :return: list of (name, count, p50 seconds, p99 seconds)
+        """
+        with self.lock:
+            return [(name, h.count, h.percentile(50), h.percentile(99))
+                    for name, h in sorted(self.histograms.items()) if names is None or name in names]
+
+    def status_line(self):
+        """p50/p99 of every timing in ms, for the status bar"""
+        return " | ".join("{} {:.1f}/{:.1f}".format(name, p50 * 1e3, p99 * 1e3)
+                          for name, count, p50, p99 in self.summary())
+
+    def prometheus(self):
+        """Text exposition format"""
+        lines = []
+        with self.lock:
+            for name, value in sorted(self.counters.items()):
+                metric = "etrade_tui_" + _metric_name(name) + "_total"
+                lines += ["# TYPE {} counter".format(metric), "{} {}".format(metric, value)]
+            for name, h in sorted(self.histograms.items()):
+                metric = "etrade_tui_" + _metric_name(name) + "_seconds"
+                lines.append("# TYPE {} histogram".format(metric))
+                cumulative = 0
+                for bound, n in zip(BUCKETS, h.counts):
+                    cumulative += n
+                    if n:
+                        lines.append('{}_bucket{{le="{:.6g}"}} {}'.format(metric, bound, cumulative))
+                lines += ['{}_bucket{{le="+Inf"}} {}'.format(metric, h.count),
+                          "{}_sum {}".format(metric, h.total), "{}_count {}".format(metric, h.count)]
+        return "\n".join(lines) + "\n"
+
+    def json_line(self):
+        """One JSON object with counters and p50/p99/mean of every timing"""
+        with self.lock:
+            timings = {name: {"count": h.count, "p50": h.percentile(50), "p99": h.percentile(99),
+                              "mean": h.total / h.count if h.count else 0.0}
+                       for name, h in sorted(self.histograms.items())}
+            counters = dict(self.counters)
+        return json.dumps({"time": time.time(), "uptime": time.time() - self.started, "counters": counters,
+                           "timings": timings})
+
+
+def _metric_name(name):
+    return "".join(c if c.isalnum() else "_" for c in name.lower())
+
+
+class Exporter:
+    def __init__(self, metrics, path, format="prometheus", interval=10.0):
+        """
+        Writes the metrics every interval seconds on a background thread
+
+        :param format: "prometheus" rewrites path with the text format (for a textfile collector),
+                       "jsonl" appends one JSON line per interval
+        """
+        self.metrics = metrics
+        self.path = path
+        self.format = format
+        self.interval = interval
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="metrics", daemon=True)
+
+    @classmethod
+    def from_config(cls, metrics, path=None, format=None):
+        """
+        Exporter set up from the [METRICS] section of config.ini, path and format override it
+
+        :return: Exporter, None if no EXPORT path is configured
+        """
+        path = path or config.get("METRICS", "EXPORT", fallback=None)
+        if not path:
+            return None
+        return cls(metrics, path, format or config.get("METRICS", "FORMAT", fallback="prometheus"),
+                   config.getfloat("METRICS", "INTERVAL", fallback=10.0))
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join(timeout=5)
+        self.write()
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            self.write()
+
+    def write(self):
+        try:
+            if self.format == "jsonl":
+                with open(self.path, "a") as f:
+                    f.write(self.metrics.json_line() + "\n")
+            else:
+                temp = self.path + ".tmp"
+                with open(temp, "w") as f:
+                    f.write(self.metrics.prometheus())
+                os.replace(temp, self.path)
+        except OSError as e:
+            logger.debug("Writing metrics failed: %s", e)
+
+
+class SamplingProfiler:
+    def __init__(self, path, interval=PROFILE_INTERVAL):
+        """
+        Samples the stacks of all other threads and writes them in collapsed stack format
+
+        Each line of path is "thread;outer;...;inner count", ready for flamegraph.pl or speedscope.
+
+        :param interval: seconds between samples
+        """
+        self.path = path
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="profiler", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join(timeout=5)
+        with open(self.path, "w") as f:
+            for stack, n in self.stacks.most_common():
+                f.write("{} {}\n".format(stack, n))
+
+    def run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self.stopping.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append("{} ({}:{})".format(code.co_name, os.path.basename(code.co_filename),
+                                                     code.co_firstlineno))
+                    frame = frame.f_back
+                if ident not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+
+
+metrics = Metrics()  # shared registry of the process
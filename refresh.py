@@ -0,0 +1,215 @@
+import asyncio
+import collections
+import inspect
+import os
+import threading
+import time
+
+from accounts.history import portfolio_rows
+from metrics import metrics
+from settings import *
+
+# Latest fetched data, replaced as a whole on every refresh. The Positions in it are shared with
+# the refresh thread, which updates their legs in place under LegStore.lock.
+Snapshot = collections.namedtuple("Snapshot", "portfolio balance time errors status")
+
+# Seconds between refreshes per endpoint, overridden in the [REFRESH] section of config.ini.
+# "marks" re-quotes the held contracts and recomputes gains in place, so the full portfolio call
+# only has to pick up new and closed positions.
+INTERVALS = {"marks": 1.0, "portfolio": 15.0, "balance": 30.0}
+MAX_BACKOFF = 300.0  # seconds
+RATE_LIMIT_BACKOFF = 10.0  # seconds, minimum wait after a 429 response
+
+
+def get_intervals():
+    """Refresh intervals per endpoint from config.ini"""
+    return {name: config.getfloat("REFRESH", name, fallback=default) for name, default in INTERVALS.items()}
+
+
+class RefreshWorker:
+    def __init__(self, client, intervals=None, history=None):
+        """
+        Fetches and builds the portfolio on a background thread and publishes Snapshots
+
+        Each endpoint is polled by its own task on the worker's event loop. Failed polls are retried
+        with exponential backoff. Every publish makes read_fd readable so the UI can wait on it.
+
+        :param client: AsyncClient, or any object with get_portfolio and get_balance methods such as
+                       Account or ReplayAccount, blocking methods are run in a thread; get_marks
+                       is polled when the client has it
+        :param intervals: dict of endpoint name -> seconds between refreshes, config.ini if None
+        :param history: SnapshotStore to record portfolios and balances in and to start from
+        """
+        self.client = client
+        self.intervals = dict(intervals or get_intervals())
+        if not hasattr(client, "get_marks") and "marks" in self.intervals:
+            # Without a quote engine fresh gains only come with the portfolio
+            marks = self.intervals.pop("marks")
+            if marks > 0 and "portfolio" in self.intervals:
+                self.intervals["portfolio"] = min(self.intervals["portfolio"], marks)
+        self.snapshot = Snapshot((), None, 0.0, {}, ())
+        self.read_fd, self.write_fd = os.pipe()
+        os.set_blocking(self.read_fd, False)
+        os.set_blocking(self.write_fd, False)
+        self.lock = threading.Lock()
+        self.changed = set()  # group keys re-quoted since the last take_changed
+        self.loop = None
+        self.stopping = None
+        self.retrying = None  # set to cut the wait of every endpoint short
+        self.thread = threading.Thread(target=self.run, name="refresh", daemon=True)
+        self.history = history
+        if history is not None:
+            self.restore()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.stop()
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.stopping.set)
+        self.thread.join(timeout=5)
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
+    def retry(self):
+        """Poll every endpoint now instead of waiting out its interval or backoff"""
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._retry)
+
+    def _retry(self):
+        self.retrying.set()  # wakes the current waiters, later waits start over
+        self.retrying.clear()
+
+    def drain(self):
+        """Clear the pending snapshot notifications and return the latest snapshot"""
+        try:
+            while os.read(self.read_fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        return self.snapshot
+
+    def take_changed(self):
+        """(date ordinal, symbol) of the positions whose prices moved since the last call"""
+        with self.lock:
+            changed, self.changed = self.changed, set()
+        return changed
+
+    def restore(self):
+        """Show the last stored snapshot until the first fetch completes"""
+        if not hasattr(self.client, "prime"):
+            return
+        account = getattr(self.client, "account_id", None)
+        last = self.history.load_last()
+        if account is not None:
+            last = {a: v for a, v in last.items() if a == account}
+        if not last:
+            return
+
+        stored = max(ts for ts, _ in last.values())
+        portfolio = self.client.prime({a: rows for a, (_, rows) in last.items()})
+        if account is not None:
+            balance = self.history.load_balance(account)
+        else:
+            balance = {a: self.history.load_balance(a) for a in last}
+        status = ("stored {}".format(time.strftime("%b %d %H:%M", time.localtime(stored))),)
+        self.snapshot = Snapshot(tuple(portfolio or ()), balance, stored, {}, status)
+
+    def record(self, name, result):
+        """Append a fetched portfolio or balance to the history"""
+        account = getattr(self.client, "account_id", None)
+        if name == "portfolio":
+            self.history.append_portfolio(portfolio_rows(result or (), account))
+        elif name == "balance" and result is not None:
+            for a, balance in (result.items() if account is None else [(account, result)]):
+                self.history.append_balance(balance, a)
+
+    def run(self):
+        asyncio.run(self.main())
+
+    async def main(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        self.retrying = asyncio.Event()
+
+        tasks = [asyncio.create_task(self.poll(name, interval)) for name, interval in self.intervals.items()
+                 if interval > 0]
+        await self.stopping.wait()
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if hasattr(self.client, "close"):
+            closed = self.client.close()
+            if inspect.isawaitable(closed):
+                await closed
+        if self.history is not None:
+            self.history.close()
+
+    async def poll(self, name, interval):
+        """Refresh one endpoint every interval seconds, backing off on errors"""
+        delay = interval
+        while True:
+            start = self.loop.time()
+            try:
+                result = await self.fetch(name)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.debug("Refresh %s failed: %s", name, e)
+                delay = min(max(delay * 2, interval), MAX_BACKOFF)
+                if getattr(e, "status", None) == 429:
+                    delay = max(delay, RATE_LIMIT_BACKOFF)
+                self.publish(name, None, e)
+            else:
+                delay = interval
+                self.publish(name, result, None)
+                if self.history is not None and name in ("portfolio", "balance"):
+                    try:
+                        await asyncio.to_thread(self.record, name, result)
+                    except Exception as e:
+                        logger.debug("Recording %s failed: %s", name, e)
+            try:
+                await asyncio.wait_for(self.retrying.wait(), max(0.0, delay - (self.loop.time() - start)))
+            except asyncio.TimeoutError:
+                pass
+            else:
+                delay = interval
+
+    async def fetch(self, name):
+        method = getattr(self.client, "get_" + name)
+        with metrics.timer("fetch " + name):
+            if asyncio.iscoroutinefunction(method):
+                return await method()
+            return await asyncio.to_thread(method)
+
+    def publish(self, name, result, exception):
+        """Replace the snapshot with the new result or error of one endpoint"""
+        with self.lock:
+            snapshot = self.snapshot
+            errors = dict(snapshot.errors)
+            if exception is None:
+                errors.pop(name, None)
+                if name == "marks" and result:
+                    self.changed |= result
+                if name == "portfolio":
+                    result = tuple(result or ())
+                if name in Snapshot._fields:
+                    snapshot = snapshot._replace(**{name: result})
+            else:
+                errors[name] = str(exception)
+                metrics.count("errors " + name)
+            status = tuple(self.client.status()) if hasattr(self.client, "status") else ()
+            self.snapshot = snapshot._replace(time=time.time(), errors=errors, status=status)
+
+        try:
+            os.write(self.write_fd, b"\0")
+        except BlockingIOError:
+            pass
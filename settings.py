@@ -2,15 +2,33 @@ import configparser
 import logging
 from logging.handlers import RotatingFileHandler
 
-# loading configuration file
+__all__ = ["config", "logger"]
+
+# configuration, empty until load_config() is called
 config = configparser.ConfigParser()
-config.read('config.ini')
 
-# logger settings
+# logger, without handlers until setup_logging() is called
 logger = logging.getLogger('my_logger')
-logger.setLevel(logging.DEBUG)
-handler = RotatingFileHandler("python_client.log", maxBytes=5 * 1024 * 1024, backupCount=3)
+
 FORMAT = "%(asctime)-15s %(message)s"
-fmt = logging.Formatter(FORMAT, datefmt='%m/%d/%Y %I:%M:%S %p')
-handler.setFormatter(fmt)
-logger.addHandler(handler)
+
+
+def load_config(path='config.ini'):
+    """Read the configuration file into config"""
+    config.read(path)
+    return config
+
+
+def setup_logging(path="python_client.log", level=None):
+    """
+    Log to a rotating file
+
+    :param level: logging level name, [LOGGING] LEVEL in config.ini if None, INFO by default
+    """
+    level = level or config.get("LOGGING", "LEVEL", fallback="INFO")
+    logger.setLevel(level)
+    if not any(isinstance(h, RotatingFileHandler) for h in logger.handlers):
+        handler = RotatingFileHandler(path, maxBytes=5 * 1024 * 1024, backupCount=3)
+        handler.setFormatter(logging.Formatter(FORMAT, datefmt='%m/%d/%Y %I:%M:%S %p'))
+        logger.addHandler(handler)
+    return logger
@@ -0,0 +1,68 @@
+import curses
+
+
+class HeadlessPad:
+    """In-memory stand-in for a curses window or pad, keeps the text written to it"""
+
+    def __init__(self, height, width):
+        self.height = height
+        self.width = width
+        self.rows = [[" "] * width for _ in range(height)]
+        self.y = self.x = 0
+        self.writes = 0
+        self.refreshes = 0
+
+    def getmaxyx(self):
+        return self.height, self.width
+
+    def addstr(self, y, x, text, attr=0):
+        if y >= self.height or x + len(text) > self.width:
+            raise curses.error("addstr() returned ERR")
+        self.rows[y][x:x + len(text)] = text
+        self.y, self.x = y, x + len(text)
+        self.writes += 1
+
+    def move(self, y, x):
+        self.y, self.x = y, x
+
+    def clrtoeol(self):
+        self.rows[self.y][self.x:] = " " * (self.width - self.x)
+
+    def erase(self):
+        self.rows = [[" "] * self.width for _ in range(self.height)]
+
+    clear = erase
+
+    def noutrefresh(self, *args):
+        self.refreshes += 1
+
+    refresh = noutrefresh
+
+    def text(self, y):
+        return "".join(self.rows[y]).rstrip()
+
+
+class HeadlessScreen(HeadlessPad):
+    """Screen for Term(screen=...) without a terminal, for benchmarks and scripted runs"""
+
+    def __init__(self, height=40, width=160, keys=()):
+        super().__init__(height, width)
+        self.keys = list(keys)
+        self.pads = []
+        self.updates = 0
+
+    def newpad(self, height, width):
+        self.pads.append(HeadlessPad(height, width))
+        return self.pads[-1]
+
+    def doupdate(self):
+        self.updates += 1
+
+    def getch(self):
+        return self.keys.pop(0) if self.keys else -1
+
+    def keypad(self, flag):
+        pass
+
+    def nodelay(self, flag):
+        pass
@@ -0,0 +1,190 @@
+import bisect
+import datetime
+
+# Sort columns in the order the sort key cycles through them, name -> value of a position
+SORT_KEYS = {
+    "expiry": lambda p: p.date.toordinal(),
+    "symbol": lambda p: p.symbol,
+    "strategy": lambda p: p.strategy,
+    "day gain $": lambda p: p.days_gain,
+    "day gain %": lambda p: p.days_gain_pct,
+    "total gain $": lambda p: p.total_gain,
+    "total gain %": lambda p: p.total_gain_pct,
+    "delta": lambda p: p.delta,
+    "theta": lambda p: p.theta,
+    "vega": lambda p: p.vega,
+}
+
+
+def group_key(position):
+    return position.date.toordinal(), position.symbol
+
+
+class SortedIndex:
+    """Group keys ordered by one column, kept sorted as values change"""
+
+    def __init__(self, key):
+        self.key = key
+        self.entries = []  # sorted (missing, value, date ordinal, symbol), missing values last
+        self.current = {}  # group key -> its entry
+
+    def entry(self, group, position):
+        value = self.key(position)
+        if value is None or value != value:
+            return (True, 0) + group
+        return (False, value) + group
+
+    def build(self, positions):
+        """Index a whole portfolio at once, positions is a dict of group key -> position"""
+        self.current = {group: self.entry(group, p) for group, p in positions.items()}
+        self.entries = sorted(self.current.values())
+
+    def update(self, group, position):
+        """
+        Re-index one position after its values changed
+
+        :return: True if its rank changed
+        """
+        new = self.entry(group, position)
+        old = self.current.get(group)
+        if old == new:
+            return False
+        rank = None
+        if old is not None:
+            rank = bisect.bisect_left(self.entries, old)
+            del self.entries[rank]
+        self.current[group] = new
+        at = bisect.bisect_left(self.entries, new)
+        self.entries.insert(at, new)
+        return at != rank
+
+    def remove(self, group):
+        del self.entries[bisect.bisect_left(self.entries, self.current.pop(group))]
+
+    def groups(self, reverse=False):
+        """Group keys in order, missing values last either way"""
+        if not reverse:
+            return [e[2:] for e in self.entries]
+        split = bisect.bisect_left(self.entries, (True,))
+        return [e[2:] for e in reversed(self.entries[:split])] + [e[2:] for e in self.entries[split:]]
+
+    def range(self, low, high):
+        """Group keys with low <= value < high"""
+        start = bisect.bisect_left(self.entries, (False, low))
+        end = bisect.bisect_left(self.entries, (False, high))
+        return [e[2:] for e in self.entries[start:end]]
+
+
+class PortfolioOrder:
+    def __init__(self):
+        """
+        Sort and filter state of the portfolio view
+
+        A SortedIndex is built the first time a column is sorted by and kept up to date from
+        then on, so changing the sort only reads an index. Snapshots that only moved prices
+        re-index just the positions that changed; a new portfolio is diffed by group key.
+        """
+        self.positions = {}  # group key -> position
+        self.indexes = {}  # column name -> SortedIndex
+        self.portfolio = None
+        self.view = None  # positions in display order, None when it has to be recomputed
+
+        self.sort = "expiry"
+        self.reverse = False
+        self.search = ""  # symbol prefix
+        self.this_week = False  # only positions expiring by Friday
+
+    def index(self, column):
+        index = self.indexes.get(column)
+        if index is None:
+            index = self.indexes[column] = SortedIndex(SORT_KEYS[column])
+            index.build(self.positions)
+        return index
+
+    def update(self, portfolio, changed=None):
+        """
+        Bring the indexes up to date with a snapshot
+
+        :param changed: group keys whose values changed since the last call, ignored when the
+                        portfolio itself was replaced
+        :return: True if the order shown has to change
+        """
+        moved = False
+        if portfolio is not self.portfolio:
+            self.portfolio = portfolio
+            positions = {group_key(p): p for p in portfolio}
+            for group in [g for g in self.positions if g not in positions]:
+                for index in self.indexes.values():
+                    index.remove(group)
+            self.positions = positions
+            for index in self.indexes.values():
+                for group, p in positions.items():
+                    index.update(group, p)
+            moved = True
+        elif changed:
+            for group in changed:
+                p = self.positions.get(group)
+                if p is None:
+                    continue
+                for column, index in self.indexes.items():
+                    moved |= index.update(group, p) and column == self.sort
+
+        if moved or self.view is None:
+            self.view = self.get_view()
+            return True
+        return False
+
+    def get_view(self):
+        """Positions that pass the filters, in sort order"""
+        index = self.index(self.sort)
+        if not self.search and not self.this_week:
+            return [self.positions[g] for g in index.groups(self.reverse)]
+
+        allowed = None
+        if self.search:
+            allowed = set(self.index("symbol").range(self.search, self.search + "\uffff"))
+        if self.this_week:
+            today = datetime.date.today()
+            friday = today + datetime.timedelta(days=(4 - today.weekday()) % 7)
+            week = set(self.index("expiry").range(today.toordinal(), friday.toordinal() + 1))
+            allowed = week if allowed is None else allowed & week
+
+        # Only the matching positions are sorted, by their entries in the sort index
+        entries = sorted(index.current[g] for g in allowed)
+        if self.reverse:
+            split = bisect.bisect_left(entries, (True,))
+            entries = entries[:split][::-1] + entries[split:]
+        return [self.positions[e[2:]] for e in entries]
+
+    def next_sort(self):
+        columns = list(SORT_KEYS)
+        self.sort = columns[(columns.index(self.sort) + 1) % len(columns)]
+        self.view = None
+
+    def toggle_reverse(self):
+        self.reverse = not self.reverse
+        self.view = None
+
+    def set_search(self, text):
+        self.search = text.upper()
+        self.view = None
+
+    def toggle_this_week(self):
+        self.this_week = not self.this_week
+        self.view = None
+
+    def clear(self):
+        self.search = ""
+        self.this_week = False
+        self.view = None
+
+    def describe(self):
+        """Footer text of the non-default sort and filters, empty if there are none"""
+        parts = []
+        if self.sort != "expiry" or self.reverse:
+            parts.append("sort {} {}".format(self.sort, "▼" if self.reverse else "▲"))
+        if self.search:
+            parts.append("/" + self.search)
+        if self.this_week:
+            parts.append("expiring this week")
+        return " | ".join(parts)
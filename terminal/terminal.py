@@ -1,12 +1,106 @@
+import contextlib
 import curses
+import select
+import sys
+import time
 
-TF = "{:1}{:^16}{:^8}{:^5}{:^20}{:^20}{:^16}{:^16}{:^16}{:^16}{:^16}"
+from accounts.portfolio import STOCK, STOCK_DATE, sum_risk
+from metrics import metrics
+from terminal.order import PortfolioOrder
+
+TF = "{:1}{:^11}{:^7}{:^5}{:^30}{:^17}{:^11}{:^11}{:^9}{:^11}{:^9}{:^7}{:^9}{:^8}{:^9}{:^9}"
+HEADER = (" ", "Date", "Symbol", "Q", "Type", "Strike Prices", "Paid $", "Day $",
+          "Day %", "Total $", "Total %", "IV %", "Delta", "Gamma", "Theta $", "Vega $")
+SCROLL_COLUMNS = 10  # columns moved per Left / Right key
+
+
+def risk_values(risk, iv=None):
+    """IV and (delta, gamma, theta, vega) columns, blank where the leg has no quote yet"""
+    values = (iv * 100 if iv is not None else None,) + tuple(risk)
+    return tuple("" if v is None or v != v else round(v, 2) for v in values)
+
+
+def position_values(position):
+    date = "Stock" if position.date == STOCK_DATE else position.date.strftime("%b %d '%y")
+    return ("▼" if position.show_spreads else "▶", date, position.symbol,
+            "", position.strategy, "", "",
+            position.days_gain, position.days_gain_pct,
+            position.total_gain, position.total_gain_pct) + risk_values(position.risk())
+
+
+def spread_values(s):
+    return ('', '', "▼" if s.show_legs else "▶", s.quantity,
+            s.option_type.capitalize() + " " + s.direction.capitalize() + " Spread" + "s" * int(s.quantity > 1),
+            str(s.strikes[0]) + " / " + str(s.strikes[1]), s.price_paid,
+            s.days_gain, s.days_gain_pct, s.total_gain, s.total_gain_pct) + risk_values(s.risk())
+
+
+def leg_values(leg):
+    strike = "" if leg.option_type == STOCK else leg.strike
+    return ('', '', '', leg.quantity, leg.option_type, strike, leg.price_paid,
+            leg.days_gain, leg.days_gain_pct, leg.total_gain, leg.total_gain_pct) + risk_values(leg.risk(), leg.iv)
+
+
+def rest_values(rest):
+    """Unpaired part of a partly paired leg, rest is (leg, signed quantity): gains and greeks for that part"""
+    leg, quantity = rest
+    share = abs(quantity) / abs(leg.quantity)
+    strike = "" if leg.option_type == STOCK else leg.strike
+    return ('', '', '', quantity, leg.option_type, strike, leg.price_paid,
+            round(leg.days_gain * share, 2), leg.days_gain_pct, round(leg.total_gain * share, 2),
+            leg.total_gain_pct) + risk_values([v * share for v in leg.risk()], leg.iv)
+
+
+def total_values(total):
+    """Greeks of all the shown positions of one underlying, total is (symbol, positions)"""
+    symbol, positions = total
+    return ("", "", symbol, "", "Total", "", "", "", "", "", "") + \
+        risk_values(sum_risk(p.risk() for p in positions))
+
+
+# Column values of a portfolio row by kind
+ROW_VALUES = {"position": position_values, "spread": spread_values, "leg": leg_values, "rest": rest_values,
+              "total": total_values}
 
 
 class Term:
-    def __init__(self):
+    def __init__(self, screen=None):
+        """
+        :param screen: headless stand-in for the curses screen (see terminal.headless), curses if None
+        """
         self.stream = []
-        self.vposition = 0
+
+        self.portfolio = None
+        self.index = []  # (key, kind, item) of the visible rows, see get_portfolio_index
+        self.cursor = 0  # selected row in index
+        self.top = 0  # first row of index in the window
+        self.left = 0  # first column of the rows in the window, when they are wider than it
+        self.height = 1  # rows in the window below the header
+
+        self.pad = None
+        self.lines = []  # (text, highlighted) currently drawn on each pad row
+        self.view = None  # (height, width, left) of the last pad refresh
+        self.row_cache = {}  # row key -> (values, formatted text)
+        self.frame_cache = {}
+        self.show_frame_time = False
+        self.frame_time = 0.0
+        self.show_metrics = False  # p50/p99 ms of the pipeline stages in the bottom line
+        self.status = []  # messages for the bottom line, e.g. per account fetch status
+        self.order = PortfolioOrder()  # sort and filters of the positions
+        self.searching = False  # typing a symbol search after '/'
+        self.footer = False  # bottom line shown
+        self.footer_text = None
+
+        self.headless = screen is not None
+        if self.headless:
+            self.stdscr = screen
+            self.newpad = screen.newpad
+            self.doupdate = screen.doupdate
+            self.highlight = curses.A_REVERSE
+            return
+
+        self.newpad = curses.newpad
+        self.doupdate = curses.doupdate
 
         self.stdscr = curses.initscr()
         self.stdscr.keypad(True)
@@ -21,98 +115,299 @@ class Term:
 
         curses.start_color()
         curses.init_pair(1, curses.COLOR_BLACK, curses.COLOR_WHITE)
+        self.highlight = curses.color_pair(1)
 
     def __enter__(self):
         return self
 
     def __exit__(self, type, value, traceback):
+        if self.headless:
+            return
         curses.nocbreak()  # Turn off cbreak mode
         curses.echo()  # Turn echo back on
         curses.curs_set(1)  # Turn cursor back on
         curses.endwin()
 
+    @contextlib.contextmanager
+    def suspended(self):
+        """Give the terminal back for the duration of the block, e.g. to prompt on stdin"""
+        if not self.headless:
+            curses.endwin()
+        try:
+            yield
+        finally:
+            if not self.headless:
+                self.stdscr.refresh()
+            self.redraw()
+
     def tprint(self, text):
         self.stream.append(text)
 
+    def get_portfolio_index(self, portfolio):
+        """
+        Flatten the expanded Position -> Spread -> Leg tree into the list of visible rows
+
+        Nothing is formatted here, rows are formatted when they scroll into the window. A total
+        row per underlying, with the greeks summed across its expiries, follows the positions.
+
+        :return: list of (key, kind, item), keys identify a row across refreshes
+        """
+        index = []
+        symbols = {}
+        for position in portfolio:
+            index.append((("position", position.date, position.symbol), "position", position))
+            if position.show_spreads:
+                index.extend(self.get_position_index(position))
+            symbols.setdefault(position.symbol, []).append(position)
+        for symbol in sorted(symbols):
+            index.append((("total", symbol), "total", (symbol, symbols[symbol])))
+        return index
+
+    def get_position_index(self, position):
+        """Rows under an expanded position"""
+        index = []
+        paired = {}
+        for s in position.spreads:
+            paired[s.leg1.id] = paired.get(s.leg1.id, 0) + s.quantity
+            paired[s.leg2.id] = paired.get(s.leg2.id, 0) + s.quantity
+
+            index.append((("spread", s.leg1.id, s.leg2.id), "spread", s))
+            if s.show_legs:
+                index.extend(self.get_spread_index(s))
+
+        # Legs no spread took, or the part of a leg its spreads did not cover
+        for leg in position.legs:
+            rest = abs(leg.quantity) - paired.get(leg.id, 0)
+            if rest == abs(leg.quantity):
+                index.append((("leg", leg.id), "leg", leg))
+            elif rest > 0:
+                index.append((("leg", leg.id), "rest", (leg, rest if leg.quantity > 0 else -rest)))
+        return index
+
+    def get_spread_index(self, s):
+        """Rows under an expanded spread"""
+        spread_key = ("spread", s.leg1.id, s.leg2.id)
+        return [(spread_key + (s.leg1.id,), "leg", s.leg1), (spread_key + (s.leg2.id,), "leg", s.leg2)]
+
+    def toggle(self):
+        """Expand or collapse the row under the cursor, splicing its children in or out of the index"""
+        if self.cursor >= len(self.index):
+            return
+        _, kind, item = self.index[self.cursor]
+        below = self.cursor + 1
+
+        if kind == "position":
+            item.show_spreads = not item.show_spreads
+            if item.show_spreads:
+                self.index[below:below] = self.get_position_index(item)
+            else:
+                end = below
+                while end < len(self.index) and self.index[end][1] in ("spread", "leg", "rest"):
+                    end += 1
+                del self.index[below:end]
+
+        elif kind == "spread":
+            item.show_legs = not item.show_legs
+            if item.show_legs:
+                self.index[below:below] = self.get_spread_index(item)
+            else:
+                del self.index[below:below + 2]
+
+    def format_row(self, key, values):
+        """Formatted text of a row, reused from the previous frame when its values did not change"""
+        cached = self.row_cache.get(key)
+        if cached is None or cached[0] != values:
+            cached = (values, TF.format(*values))
+        self.frame_cache[key] = cached
+        return cached[1]
+
     def get_portfolio_stream(self, portfolio):
-        tp = self.tprint
+        """Formatted text of every row of the portfolio, header first"""
+        return [TF.format(*HEADER)] + [TF.format(*ROW_VALUES[kind](item))
+                                       for _, kind, item in self.get_portfolio_index(portfolio)]
 
-        header = TF.format(" ", "Date", "Symbol", "Q", "Type", "Strike Prices", "Price Paid $", "Day Gain $",
-                           "Day Gain %", "Total Gain $", "Total Gain %")
+    def set_portfolio(self, portfolio):
+        """Rebuild the row index in the current sort order, keeping the cursor on the same row"""
+        key = self.index[self.cursor][0] if self.cursor < len(self.index) else None
+        self.portfolio = portfolio
+        self.index = self.get_portfolio_index(self.order.view)
 
-        # tp(self.ljust(self.bold(header)))
-        tp(header)
-        # tp(self.ljust('', self.width, '═'))
+        if key is not None:
+            self.cursor = next((i for i, entry in enumerate(self.index) if entry[0] == key), self.cursor)
+        self.scroll(0)
 
-        for position in portfolio:
-            spread_ids = []
-            txt = TF.format("▼" if position.show_spreads else "▶", position.date.strftime("%b %d '%y"), position.symbol,
-                            "", position.strategy, "", "",
-                            position.days_gain, position.days_gain_pct,
-                            position.total_gain, position.total_gain_pct)
-            # tp(self.bold(self.ljust(txt)))
-            tp(txt)
+    def scroll(self, rows, page=False):
+        """
+        Move the cursor by rows, scrolling the window just enough to keep it visible
 
-            if position.show_spreads:
-                for s in position.spreads:
-                    spread_ids.append(s.leg1.id)
-                    spread_ids.append(s.leg2.id)
-
-                    txt = TF.format('', '', "▼" if s.show_legs else "▶", s.quantity,
-                                    s.option_type.capitalize() + " " + s.direction.capitalize() +
-                                    " Spread" + "s" * int(s.quantity > 1),
-                                    str(s.strikes[0]) + " / " + str(s.strikes[1]), s.price_paid,
-                                    s.days_gain, s.days_gain_pct, s.total_gain, s.total_gain_pct)
-                    tp(txt)
-
-                    if s.show_legs:
-                        tp(TF.format('', '', '', s.leg1.quantity, s.leg1.option_type, s.leg1.strike, s.leg1.price_paid,
-                                     s.leg1.days_gain, s.leg1.days_gain_pct, s.leg1.total_gain, s.leg1.total_gain_pct))
-                        tp(TF.format('', '', '', s.leg2.quantity, s.leg2.option_type, s.leg2.strike, s.leg2.price_paid,
-                                     s.leg2.days_gain, s.leg2.days_gain_pct, s.leg2.total_gain, s.leg2.total_gain_pct))
-
-                for leg in position.legs:
-                    if leg.id not in spread_ids:
-                        tp(TF.format('', '', '', leg.quantity, leg.option_type, leg.strike, leg.price_paid,
-                                     leg.days_gain,
-                                     leg.days_gain_pct, leg.total_gain, leg.total_gain_pct))
-
-            # tp(self.ljust('', self.width, '─'))
-        result = self.stream
-        self.stream = []
-        return result
+        :param page: scroll the window along with the cursor
+        """
+        last = max(len(self.index) - 1, 0)
+        self.cursor = max(min(self.cursor + rows, last), 0)
+        if page:
+            self.top += rows
+
+        if self.cursor < self.top:
+            self.top = self.cursor
+        elif self.cursor >= self.top + self.height:
+            self.top = self.cursor - self.height + 1
+        self.top = max(min(self.top, len(self.index) - self.height), 0)
 
-    def show_portfolio(self, portfolio):
-        pad = curses.newpad(1, 1)
+    def show_portfolio(self, portfolio, changed=None):
+        """
+        Draw the rows in the window, writing only the ones that changed since the last frame
+
+        :param changed: (date ordinal, symbol) of the positions whose values changed since the
+                        last call, when the portfolio is the same object
+        """
+        start = time.perf_counter()
 
         wh, ww = self.stdscr.getmaxyx()
+        filters = self.order.describe()
+        footer = self.show_frame_time or self.show_metrics or bool(self.status) or bool(filters) or self.searching
+        if footer != self.footer:
+            self.footer = footer
+            self.redraw()
+        if footer:
+            wh -= 1
+        self.height = max(wh - 1, 1)  # below the header
 
-        p = self.get_portfolio_stream(portfolio)
-        pad.resize(len(p) + 1 + wh, len(p[0]) + 1)
-        ph, pw = pad.getmaxyx()
+        if self.order.update(portfolio, changed) or portfolio is not self.portfolio:
+            self.set_portfolio(portfolio)
+        else:
+            self.scroll(0)
 
-        for y, i in enumerate(p):
-            if y == self.vposition:
-                pad.addstr(y, 0, i, curses.color_pair(1))
-            else:
-                pad.addstr(y, 0, i)
+        self.frame_cache = {}
+        lines = [(self.format_row(HEADER, HEADER), False)]
+        for y, (key, kind, item) in enumerate(self.index[self.top:self.top + self.height], self.top):
+            lines.append((self.format_row(key, ROW_VALUES[kind](item)), y == self.cursor))
+        self.row_cache, self.frame_cache = self.frame_cache, {}
 
-        pad_position = wh * (self.vposition // wh)
-        pad.refresh(pad_position, 0, 0, 0, wh - 1, ww - 1)
-        self.stdscr.refresh()
-        c = self.stdscr.getch()
-        if c == curses.KEY_DOWN:
-            self.vposition += 1
+        # One long-lived pad the size of the window, only replaced when the window grows
+        ph, pw = self.pad.getmaxyx() if self.pad is not None else (0, 0)
+        width = max(len(text) for text, _ in lines) + 1
+        if wh + 1 > ph or width > pw:
+            self.pad = self.newpad(max(wh + 1, ph), max(width, pw))
+            self.lines = []
+
+        dirty = 0
+        for y, line in enumerate(lines):
+            if y >= len(self.lines) or self.lines[y] != line:
+                self.pad.addstr(y, 0, line[0], self.highlight if line[1] else curses.A_NORMAL)
+                self.pad.clrtoeol()
+                dirty += 1
+        for y in range(len(lines), len(self.lines)):
+            self.pad.move(y, 0)
+            self.pad.clrtoeol()
+            dirty += 1
+        self.lines = lines
+
+        self.left = max(min(self.left, width - ww), 0)
+        view = (wh, ww, self.left)
+        update = dirty or view != self.view
+        if update:
+            self.pad.noutrefresh(0, self.left, 0, 0, wh - 1, ww - 1)
+            self.view = view
+
+        self.frame_time = time.perf_counter() - start
+        metrics.observe("render", self.frame_time)
+        if footer:
+            parts = list(self.status)
+            if self.searching:
+                parts.insert(0, "/" + self.order.search + "_")
+            elif filters:
+                parts.insert(0, filters)
+            if self.show_metrics:
+                parts.insert(0, "p50/p99 ms " + metrics.status_line())
+            if self.show_frame_time:
+                parts.insert(0, "frame {:.2f} ms | rows {}-{} of {} | redrawn {}".format(
+                    self.frame_time * 1e3, self.top + 1, self.top + len(lines) - 1, len(self.index), dirty))
+            text = " | ".join(parts)[:ww - 1]
+            if text != self.footer_text:
+                self.stdscr.addstr(wh, 0, text)
+                self.stdscr.clrtoeol()
+                self.stdscr.noutrefresh()
+                self.footer_text = text
+                update = True
+
+        if update:
+            self.doupdate()
+
+    def handle_key(self, c):
+        """Apply a key press to the portfolio view"""
+        if self.searching:
+            self.handle_search_key(c)
+        elif c == curses.KEY_DOWN:
+            self.scroll(1)
         elif c == curses.KEY_UP:
-            self.vposition -= 1
+            self.scroll(-1)
+        elif c == curses.KEY_NPAGE:
+            self.scroll(self.height, page=True)
+        elif c == curses.KEY_PPAGE:
+            self.scroll(-self.height, page=True)
+        elif c == curses.KEY_LEFT:
+            self.left = max(self.left - SCROLL_COLUMNS, 0)
+        elif c == curses.KEY_RIGHT:
+            self.left += SCROLL_COLUMNS  # show_portfolio stops it at the right edge of the rows
+        elif c == curses.KEY_HOME:
+            self.scroll(-len(self.index))
+        elif c == curses.KEY_END:
+            self.scroll(len(self.index))
         elif c == ord(' '):
-            portfolio[self.vposition - 1].show_spreads = not portfolio[self.vposition - 1].show_spreads
+            self.toggle()
+        elif c == ord('f'):
+            self.show_frame_time = not self.show_frame_time
+        elif c == ord('m'):
+            self.show_metrics = not self.show_metrics
+        elif c == ord('s'):
+            self.order.next_sort()
+        elif c == ord('r'):
+            self.order.toggle_reverse()
+        elif c == ord('w'):
+            self.order.toggle_this_week()
+        elif c == ord('/'):
+            self.searching = True
+            self.order.set_search("")
+        elif c == 27:  # Esc
+            self.order.clear()
+        elif c == curses.KEY_RESIZE:
+            self.redraw()
+
+    def handle_search_key(self, c):
+        """Edit the symbol search, the view filters as it is typed"""
+        if c in (10, 13, curses.KEY_ENTER):
+            self.searching = False
+        elif c == 27:  # Esc
+            self.searching = False
+            self.order.set_search("")
+        elif c in (8, 127, curses.KEY_BACKSPACE):
+            self.order.set_search(self.order.search[:-1])
+        elif 32 < c < 127:
+            self.order.set_search(self.order.search + chr(c))
 
-            self.vposition = max(min(self.vposition, ph - wh - 2), 1)
-            # else:
-            #    first_pass = False
+    def redraw(self):
+        """Forget what is on screen so the next frame draws everything"""
+        self.lines = []
+        self.view = None
+        self.footer_text = None
+        self.stdscr.erase()
+        self.stdscr.noutrefresh()
 
-            pad.erase()
+    def wait(self, fds=(), timeout=None):
+        """
+        Block until a key is pressed, one of fds is readable or timeout seconds passed
+
+        :return: list of the readable fds, excluding the keyboard
+        """
+        readable, _, _ = select.select([sys.stdin] + list(fds), [], [], timeout)
+        return [fd for fd in readable if fd is not sys.stdin]
+
+    def keys(self):
+        """Key presses waiting in the input buffer"""
+        c = self.stdscr.getch()
+        while c != -1:
+            yield c
+            c = self.stdscr.getch()
 
     def show_balance(self, balance_data):
         pad = curses.newpad(80, 7)
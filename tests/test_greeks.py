@@ -0,0 +1,37 @@
+import numpy as np
+
+from accounts.greeks import MAX_VOL, MIN_VOL, black_scholes, implied_vol
+
+RATE = 0.04
+
+
+def solve(price, spot, strike, years, call=True):
+    arrays = [np.array([float(v)]) for v in (price, spot, strike, years)]
+    return implied_vol(*arrays, RATE, np.array([call]))[0]
+
+
+def test_implied_vol_reprices():
+    for vol in (0.05, 0.2, 0.8, 3.0):
+        for call in (True, False):
+            spot, strike, years = np.array([100.0]), np.array([105.0]), np.array([0.25])
+            price = black_scholes(spot, strike, years, RATE, np.array([vol]), np.array([call]))[0][0]
+            assert abs(solve(price, 100, 105, 0.25, call) - vol) < 1e-4
+
+
+def test_implied_vol_above_max_vol_is_nan():
+    # 15 minutes to expiry, 10% out of the money: not even MAX_VOL is worth 5 cents
+    years = 15 / 60 / 24 / 365
+    assert black_scholes(np.array([100.0]), np.array([110.0]), np.array([years]), RATE,
+                         np.array([MAX_VOL]), np.array([True]))[0][0] < 0.05
+    assert np.isnan(solve(0.05, 100, 110, years))
+
+
+def test_implied_vol_below_min_vol_is_nan():
+    floor = black_scholes(np.array([100.0]), np.array([95.0]), np.array([0.5]), RATE,
+                          np.array([MIN_VOL]), np.array([True]))[0][0]
+    assert np.isnan(solve(floor - 0.01, 100, 95, 0.5))
+
+
+def test_implied_vol_outside_arbitrage_bounds_is_nan():
+    assert np.isnan(solve(0.0, 100, 110, 0.25))
+    assert np.isnan(solve(101.0, 100, 90, 0.25))
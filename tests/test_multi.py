@@ -0,0 +1,41 @@
+import asyncio
+import json
+
+from accounts.client import OAuth1Signer
+from accounts.multi import MultiAccount
+from tools import stub_server
+
+
+def make_server(accounts):
+    fixtures = stub_server.synthetic_fixtures(20)
+    fixtures["list"] = json.dumps({"AccountListResponse": {"Accounts": {"Account": accounts}}}).encode()
+    return stub_server.serve(fixtures)
+
+
+async def refresh(server):
+    client = MultiAccount(OAuth1Signer("key", "secret", "token", "token secret"),
+                          "http://127.0.0.1:%d" % server.server_port)
+    try:
+        return await client.get_portfolio(), await client.get_balance(), await client.get_marks()
+    finally:
+        await client.close()
+
+
+def test_no_open_accounts():
+    server = make_server([{"accountId": "1", "accountIdKey": "k1", "accountStatus": "CLOSED",
+                           "institutionType": "BROKERAGE"}])
+    try:
+        assert asyncio.run(refresh(server)) == ([], {}, set())
+    finally:
+        server.shutdown()
+
+
+def test_open_account():
+    server = make_server([{"accountId": "12345678", "accountIdKey": "k12345678", "accountStatus": "ACTIVE",
+                           "institutionType": "BROKERAGE"}])
+    try:
+        portfolio, balances, _ = asyncio.run(refresh(server))
+        assert sum(len(p.legs) for p in portfolio) == 20
+        assert list(balances) == ["12345678"]
+    finally:
+        server.shutdown()
@@ -0,0 +1,32 @@
+import pytest
+
+from accounts.portfolio import pair_legs
+
+
+@pytest.mark.parametrize("quantities, pairs", [
+    ([1, -1], [(0, 1, 1)]),
+    ([-2, 2], [(0, 1, 2)]),
+    ([1, 1], []),
+    ([10, -5, -5], [(0, 1, 5), (0, 2, 5)]),  # one long leg against two short ones
+    ([-5, -5, 10], [(0, 2, 5), (1, 2, 5)]),
+    ([10, -4], [(0, 1, 4)]),  # the rest of the long leg stays unpaired
+    ([-3, 5, -2], [(0, 1, 3), (1, 2, 2)]),  # the partly paired leg pairs again
+    ([5, 10, -5], [(0, 2, 5)]),  # an exact opposite quantity goes first
+    ([5, 3, -3, -5], [(1, 2, 3), (0, 3, 5)]),
+    ([2, -1, -1, 2, -2], [(0, 1, 1), (0, 2, 1), (3, 4, 2)]),
+])
+def test_pair_legs(quantities, pairs):
+    strikes = [100.0 + 5 * n for n in range(len(quantities))]
+    assert pair_legs(strikes, quantities) == pairs
+
+
+@pytest.mark.parametrize("quantities", [[10, -5, -5], [-3, 5, -2], [7, -2, -3, 4, -6], [1, 2, 3, -6, -1]])
+def test_pair_legs_covers_the_smaller_side(quantities):
+    pairs = pair_legs(list(range(len(quantities))), quantities)
+    paired = [0] * len(quantities)
+    for i, j, n in pairs:
+        assert i < j and n > 0 and (quantities[i] > 0) != (quantities[j] > 0)
+        paired[i] += n
+        paired[j] += n
+    assert all(p <= abs(q) for p, q in zip(paired, quantities))
+    assert sum(paired) // 2 == min(sum(q for q in quantities if q > 0), -sum(q for q in quantities if q < 0))
@@ -0,0 +1,76 @@
+from collections import namedtuple
+
+import pytest
+
+from accounts.strategy import PATTERNS, STOCK, classify, classify_symbol
+
+Leg = namedtuple("Leg", "option_type strike quantity")
+
+EQUAL_WINGS = (100.0, 105.0, 110.0, 115.0)
+BROKEN_WINGS = (100.0, 105.0, 115.0, 120.0)
+
+
+def make_legs(pattern, strikes, lot=1, sign=1):
+    """Legs of a PATTERNS entry at the given strikes per rank"""
+    return [Leg(option_type, strikes[rank], quantity * lot * sign) for rank, option_type, quantity in pattern]
+
+
+@pytest.mark.parametrize("name, negated, pattern, wings", PATTERNS, ids=[p[0] for p in PATTERNS])
+@pytest.mark.parametrize("lot", (1, 3))
+def test_pattern(name, negated, pattern, wings, lot):
+    strikes = BROKEN_WINGS if wings is False else EQUAL_WINGS
+    assert classify(make_legs(pattern, strikes, lot)) == name
+    if negated is not None:
+        assert classify(make_legs(pattern, strikes, lot, -1)) == negated
+
+
+def test_pattern_legs_in_any_order():
+    legs = make_legs([(0, "PUT", 1), (1, "PUT", -1), (2, "CALL", -1), (3, "CALL", 1)], EQUAL_WINGS)
+    assert classify(legs[::-1]) == "Short Iron Condor"
+
+
+def test_butterfly_wings():
+    pattern = [(0, "CALL", 1), (1, "CALL", -2), (2, "CALL", 1)]
+    assert classify(make_legs(pattern, (1.1, 1.2, 1.3))) == "Long Call Butterfly"
+    assert classify(make_legs(pattern, (1.1, 1.2, 1.4))) == "Broken Wing Call Butterfly"
+    assert classify(make_legs(pattern, (1.1, 1.2, 1.3), sign=-1)) == "Short Call Butterfly"
+
+
+def test_split_legs_are_merged():
+    legs = [Leg("CALL", 100.0, 1), Leg("CALL", 100.0, 1), Leg("CALL", 105.0, -2)]
+    assert classify(legs) == "Bull Call Spread"
+
+
+def test_flat_and_unknown():
+    assert classify([Leg("CALL", 100.0, 1), Leg("CALL", 100.0, -1)]) == "Flat"
+    assert classify([Leg("CALL", 100.0, 1), Leg("CALL", 105.0, -1), Leg("CALL", 110.0, -5)]) == \
+        "Complex Strategy"
+    assert classify([Leg("PUT", 100.0 + n, 1) for n in range(5)]) == "Complex Strategy"
+
+
+@pytest.mark.parametrize("groups, expected", [
+    ([[Leg("CALL", 100.0, -1)], [Leg("CALL", 100.0, 1)]], "Long Call Calendar"),
+    ([[Leg("CALL", 100.0, 1)], [Leg("CALL", 100.0, -1)]], "Short Call Calendar"),
+    ([[Leg("PUT", 95.0, -2)], [Leg("PUT", 90.0, 2)]], "Long Put Diagonal"),
+    ([[Leg("PUT", 95.0, 2)], [Leg("PUT", 90.0, -2)]], "Short Put Diagonal"),
+    ([[Leg("CALL", 110.0, -2)], [Leg(STOCK, 0.0, 200)]], "Covered Call"),
+    ([[Leg("PUT", 90.0, 1)], [Leg(STOCK, 0.0, 100)]], "Protective Put"),
+    ([[Leg("CALL", 110.0, -1)], [Leg("PUT", 90.0, 1)], [Leg(STOCK, 0.0, 100)]], "Collar"),
+    ([[Leg("PUT", 90.0, -1)], [Leg(STOCK, 0.0, -100)]], "Covered Put"),
+])
+def test_classify_symbol(groups, expected):
+    assert classify_symbol(groups) == [expected] * len(groups)
+
+
+@pytest.mark.parametrize("groups", [
+    [[Leg("CALL", 100.0, -1)], [Leg("PUT", 100.0, 1)]],  # different types
+    [[Leg("CALL", 100.0, -1)], [Leg("CALL", 100.0, 2)]],  # different sizes
+    [[Leg("CALL", 100.0, -1)], [Leg("CALL", 105.0, 1), Leg("CALL", 110.0, -1)]],  # a spread on one side
+    [[Leg("CALL", 110.0, -3)], [Leg(STOCK, 0.0, 200)]],  # more calls than shares
+    [[Leg("CALL", 110.0, 1)], [Leg(STOCK, 0.0, 100)]],  # long call
+    [[Leg("PUT", 90.0, 1)], [Leg(STOCK, 0.0, -100)]],  # long put against short stock
+    [[Leg("CALL", 100.0, 1)]],
+    [[Leg(STOCK, 0.0, 100)]],
+])
+def test_classify_symbol_leaves_groups_alone(groups):
+    assert classify_symbol(groups) == [None] * len(groups)
@@ -0,0 +1,30 @@
+import random
+
+from accounts.builder import build_portfolio
+from benchmarks.synthetic import make_leg
+from terminal.headless import HeadlessScreen
+from terminal.terminal import ROW_VALUES, Term
+
+
+def test_partly_paired_leg_shows_its_rest():
+    rnd = random.Random(0)
+    positions = [make_leg(1, "SPY", (2026, 1, 16), "CALL", 100.0, 10, rnd),
+                 make_leg(2, "SPY", (2026, 1, 16), "CALL", 105.0, -4, rnd)]
+    position, = build_portfolio(positions)
+    rows = Term(HeadlessScreen(30, 200)).get_position_index(position)
+    assert [kind for _, kind, _ in rows] == ["spread", "rest"]
+
+    _, _, (leg, quantity) = rows[1]
+    assert (leg.id, quantity) == (1, 6)
+    values = ROW_VALUES["rest"]((leg, quantity))
+    assert values[3] == 6
+    assert values[9] == round(leg.total_gain * 0.6, 2)
+
+
+def test_unpaired_leg_shows_whole():
+    rnd = random.Random(0)
+    positions = [make_leg(1, "SPY", (2026, 1, 16), "CALL", 100.0, -3, rnd),
+                 make_leg(2, "SPY", (2026, 1, 16), "PUT", 90.0, 2, rnd)]
+    position, = build_portfolio(positions)
+    rows = Term(HeadlessScreen(30, 200)).get_position_index(position)
+    assert [(kind, item.quantity) for _, kind, item in rows] == [("leg", -3), ("leg", 2)]
@@ -0,0 +1,84 @@
+import copy
+import random
+
+import pytest
+
+from accounts.builder import build_portfolio
+from accounts.tracker import PortfolioTracker
+from benchmarks.synthetic import make_leg, make_positions
+
+
+def make_stock(position_id, symbol, quantity):
+    return {"positionId": position_id, "quantity": quantity, "pricePaid": 100.0, "daysGain": 10.0,
+            "daysGainPct": 0.1, "totalGain": 50.0, "totalGainPct": 0.5,
+            "Product": {"symbol": symbol, "securityType": "EQ"}, "Complete": {"bid": 100.5, "ask": 100.6}}
+
+
+def describe(portfolio):
+    """Everything a Position shows, in a form two builds can be compared by"""
+    return [(p.date, p.symbol, p.strategy, [leg.id for leg in p.legs],
+             [(s.leg1.id, s.leg2.id, s.quantity) for s in p.spreads],
+             (p.days_gain, p.days_gain_pct, p.total_gain, p.total_gain_pct))
+            for p in portfolio]
+
+
+def mutate(positions, rnd, next_id):
+    """Drop, resize, reprice and add legs the way consecutive portfolio responses differ"""
+    positions = copy.deepcopy(positions)
+    for p in rnd.sample(positions, rnd.randrange(len(positions) // 10 + 1)):
+        positions.remove(p)
+    for p in rnd.sample(positions, len(positions) // 5):
+        if rnd.random() < 0.5:
+            p["quantity"] *= rnd.choice((2, -1))
+        else:
+            p["totalGain"] = round(p["totalGain"] + rnd.uniform(-100, 100), 2)
+            p["Complete"]["bid"] = round(p["Complete"]["bid"] + 0.05, 2)
+    for _ in range(rnd.randrange(5)):
+        symbol = rnd.choice(positions)["Product"]["symbol"]
+        date = (2026, rnd.randrange(1, 13), 16)
+        positions.append(make_leg(next_id, symbol, date, rnd.choice(("CALL", "PUT")),
+                                  float(rnd.randrange(20, 500)), rnd.choice((1, -1, 2, -2)), rnd))
+        next_id += 1
+    if rnd.random() < 0.3:
+        positions.append(make_stock(next_id, rnd.choice(positions)["Product"]["symbol"], rnd.choice((100, -100))))
+        next_id += 1
+    return positions, next_id
+
+
+@pytest.mark.parametrize("n_legs", (1, 40, 500))
+def test_tracker_matches_full_build(n_legs):
+    rnd = random.Random(n_legs)
+    positions = make_positions(n_legs, seed=n_legs)
+    tracker = PortfolioTracker()
+    assert describe(tracker.update(positions)) == describe(build_portfolio(positions))
+
+    next_id = len(positions) + 1
+    for _ in range(20):
+        positions, next_id = mutate(positions, rnd, next_id)
+        assert describe(tracker.update(positions)) == describe(build_portfolio(positions))
+
+
+def test_tracker_keeps_untouched_positions():
+    positions = make_positions(100, seed=1)
+    tracker = PortfolioTracker()
+    before = {(p.date, p.symbol): p for p in tracker.update(positions)}
+    dropped = positions[-1]["positionId"]
+    key = next(k for k, p in before.items() if dropped in [leg.id for leg in p.legs])
+    for p in tracker.update(positions[:-1]):
+        assert (p is before[p.date, p.symbol]) == ((p.date, p.symbol) != key)
+
+
+def test_tracker_rebuilds_from_empty():
+    positions = make_positions(50, seed=2)
+    tracker = PortfolioTracker()
+    tracker.update(positions)
+    assert tracker.update([]) == []
+    assert describe(tracker.update(positions)) == describe(build_portfolio(positions))
+
+
+def test_covered_call_across_groups():
+    positions = [make_stock(1, "SPY", 200),
+                 make_leg(2, "SPY", (2026, 1, 16), "CALL", 500.0, -2, random.Random(0))]
+    tracker = PortfolioTracker()
+    assert [p.strategy for p in tracker.update(positions)] == ["Covered Call"] * 2
+    assert [p.strategy for p in tracker.update(positions[:1])] == ["Long Stock"]
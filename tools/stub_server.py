@@ -0,0 +1,227 @@
+"""
+Local stand-in for the E*TRADE API that serves recorded JSON fixtures
+
+    python -m tools.stub_server FIXTURES_DIR [--port 8080]
+    python -m tools.stub_server --synthetic 5000
+
+Point PROD_BASE_URL in config.ini to http://localhost:8080 to run against it. Fixtures are raw
+response bodies named after their endpoint: list.json, portfolio.json, balance.json and quote.json.
+Pages can be recorded as portfolio-<page>.json, otherwise portfolio.json is paged on the fly.
+A capture directory of <time ms>-<endpoint>.json files serves the latest body of each endpoint.
+Without a quote fixture, every requested symbol is quoted with a price that drifts over time.
+
+It also fakes the /oauth endpoints: set OAUTH_BASE_URL to the server url and AUTHORIZE_URL to
+<url>/authorize?key={}&token={}, the page shows the verification code to enter.
+"""
+import argparse
+import json
+import math
+import os
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import uuid
+from urllib.parse import parse_qs, unquote, urlencode, urlsplit
+
+ENDPOINTS = ("list", "portfolio", "balance", "quote")
+VERIFIER = "STUB1"  # verification code shown by the fake authorization page
+
+
+def load_fixtures(directory):
+    """Read <endpoint>.json, portfolio-<page>.json and captured <time ms>-<endpoint>.json bodies"""
+    fixtures = {}
+    for name in sorted(os.listdir(directory)):
+        stem, ext = os.path.splitext(name)
+        if ext != ".json":
+            continue
+        if stem.split("-")[0].isdigit():
+            stem = stem.split("-", 1)[1]  # captured, later files replace earlier ones
+        if stem.split("-")[0] in ENDPOINTS:
+            with open(os.path.join(directory, name), "rb") as f:
+                fixtures[stem] = f.read()
+    return fixtures
+
+
+def synthetic_fixtures(n_legs, account_id="12345678"):
+    """Fixtures for a generated book of n_legs option legs"""
+    from benchmarks.synthetic import make_portfolio_response, make_positions
+
+    account = {"accountId": account_id, "accountIdKey": "k" + account_id, "accountStatus": "ACTIVE",
+               "accountDesc": "Synthetic", "institutionType": "BROKERAGE"}
+    balance = {"BalanceResponse": {"accountId": account_id, "accountDescription": "Synthetic",
+                                   "Computed": {"marginBuyingPower": 100000.0, "cashBuyingPower": 50000.0,
+                                                "RealTimeValues": {"totalAccountValue": 250000.0}}}}
+    return {
+        "list": json.dumps({"AccountListResponse": {"Accounts": {"Account": [account]}}}).encode(),
+        "portfolio": json.dumps(make_portfolio_response(make_positions(n_legs), account_id)).encode(),
+        "balance": json.dumps(balance).encode(),
+    }
+
+
+def page(body, number, count):
+    """Cut one page of count positions out of a full PortfolioResponse body"""
+    data = json.loads(body)
+    positions = []
+    for p in data["PortfolioResponse"]["AccountPortfolio"]:
+        positions.extend(p.get("Position", []))
+    portfolio = data["PortfolioResponse"]["AccountPortfolio"][0]
+    portfolio["Position"] = positions[(number - 1) * count:number * count]
+    portfolio["totalPages"] = max(1, math.ceil(len(positions) / count))
+    data["PortfolioResponse"]["AccountPortfolio"] = [portfolio]
+    return json.dumps(data).encode()
+
+
+def synthetic_quotes(symbols):
+    """QuoteResponse for symbols, options as SYMBOL:YEAR:MONTH:DAY:CALLPUT:STRIKE"""
+    quotes = []
+    for symbol in symbols:
+        seed = zlib.crc32(symbol.encode())
+        close = 0.5 + seed % 2000 / 100
+        mark = round(close * (1 + 0.05 * math.sin(time.time() / 10 + seed)), 2)
+        product = {"symbol": symbol, "securityType": "EQ"}
+        fields = symbol.split(":")
+        if len(fields) == 6:
+            product = {"symbol": fields[0], "securityType": "OPTN", "expiryYear": int(fields[1]),
+                       "expiryMonth": int(fields[2]), "expiryDay": int(fields[3]), "callPut": fields[4],
+                       "strikePrice": float(fields[5])}
+        quotes.append({"Product": product, "All": {"bid": round(mark - 0.05, 2), "ask": round(mark + 0.05, 2),
+                                                   "lastTrade": mark, "previousClose": close}})
+    return json.dumps({"QuoteResponse": {"QuoteData": quotes}}).encode()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep connections alive
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def oauth_params(self, url):
+        """oauth_* parameters of the query string or the Authorization header"""
+        params = {k: v[0] for k, v in parse_qs(url.query).items() if k.startswith("oauth_")}
+        for part in self.headers.get("Authorization", "")[len("OAuth "):].split(","):
+            name, _, value = part.strip().partition("=")
+            params[name] = unquote(value.strip('"'))
+        return params
+
+    def do_oauth(self, url):
+        """Fake OAuth 1 provider: request token, authorize page, access token, renew and revoke"""
+        server = self.server
+        if url.path == "/authorize":
+            return self.reply(200, ("Enter this code in the app: " + VERIFIER).encode(), "text/plain")
+
+        params = self.oauth_params(url)
+        token = params.get("oauth_token")
+        with server.lock:
+            if url.path.endswith("/request_token"):
+                token = uuid.uuid4().hex
+                server.request_tokens.add(token)
+                body = {"oauth_token": token, "oauth_token_secret": uuid.uuid4().hex,
+                        "oauth_callback_confirmed": "true"}
+            elif url.path.endswith("/access_token"):
+                if token not in server.request_tokens or params.get("oauth_verifier") != VERIFIER:
+                    return self.reply(401, b"oauth_problem=token_rejected", "text/plain")
+                server.request_tokens.discard(token)
+                token = uuid.uuid4().hex
+                server.access_tokens.add(token)
+                body = {"oauth_token": token, "oauth_token_secret": uuid.uuid4().hex}
+            elif url.path.endswith("/renew_access_token"):
+                if token not in server.access_tokens:
+                    return self.reply(401, b"oauth_problem=token_rejected", "text/plain")
+                server.renewals += 1
+                return self.reply(200, b"Access Token has been renewed", "text/plain")
+            elif url.path.endswith("/revoke_access_token"):
+                server.access_tokens.discard(token)
+                return self.reply(200, b"Revoked Access Token", "text/plain")
+            else:
+                return self.reply(404, b"", "text/plain")
+        self.reply(200, urlencode(body).encode(), "application/x-www-form-urlencoded")
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests += 1
+
+        url = urlsplit(self.path)
+        if url.path.startswith("/oauth/") or url.path == "/authorize":
+            return self.do_oauth(url)
+
+        if not self.headers.get("Authorization", "").startswith("OAuth "):
+            return self.reply(401, b'{"Error": {"message": "oauth_problem=signature_missing"}}')
+
+        query = parse_qs(url.query)
+        fixtures = self.server.fixtures
+        body = None
+
+        if url.path.endswith("/accounts/list.json"):
+            body = fixtures.get("list")
+        elif url.path.endswith("/portfolio.json"):
+            number = int(query.get("pageNumber", ["1"])[0])
+            body = fixtures.get("portfolio-%d" % number)
+            if body is None and "portfolio" in fixtures:
+                body = fixtures["portfolio"]
+                if "count" in query:
+                    body = page(body, number, int(query["count"][0]))
+        elif url.path.endswith("/balance.json"):
+            body = fixtures.get("balance")
+        elif "/market/quote/" in url.path:
+            body = fixtures.get("quote")
+            if body is None:
+                symbols = url.path.rsplit("/", 1)[1][:-len(".json")].split(",")
+                body = synthetic_quotes(symbols)
+
+        if body is None:
+            return self.reply(204, b"")
+        self.reply(200, body)
+
+    def reply(self, status, body, content_type="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(fixtures, port=0):
+    """
+    Start the stub server on a background thread
+
+    :param fixtures: dict of fixture name -> body bytes
+    :param port: port to listen on, any free port if 0
+    :return: the server, base url is "http://127.0.0.1:%d" % server.server_port
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    server.daemon_threads = True
+    server.fixtures = fixtures
+    server.lock = threading.Lock()
+    server.connections = 0
+    server.requests = 0
+    server.request_tokens = set()
+    server.access_tokens = set()
+    server.renewals = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("fixtures", nargs="?", help="directory of recorded responses")
+    parser.add_argument("--synthetic", type=int, metavar="LEGS", help="serve a generated book instead")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+
+    fixtures = synthetic_fixtures(args.synthetic) if args.synthetic else load_fixtures(args.fixtures or ".")
+    server = serve(fixtures, args.port)
+    print("Serving {} on http://127.0.0.1:{}".format(", ".join(sorted(fixtures)), server.server_port))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()